@@ -1,3 +1,17 @@
-from .app import app
-
+# The Flask app is created on first access of metacorps.app.app, so that
+# metacorps.app.models can be imported for offline analysis without a
+# configured app or a database connection.
 from . import models
+
+
+def __getattr__(name):
+
+    if name == 'app':
+        from .app import app
+        # importing the submodule bound its name here; rebind to the app
+        globals()['app'] = app
+        return app
+
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
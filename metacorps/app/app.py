@@ -1,6 +1,12 @@
 import json
 
-from flask import Flask, render_template, redirect, url_for, jsonify, request
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+
+from flask import (
+    Flask, render_template, redirect, url_for, jsonify, request, abort
+)
 from flask_mongoengine import MongoEngine
 from flask_security import (
     MongoEngineUserDatastore, Security, login_required, logout_user,
@@ -21,22 +27,256 @@ from . import models
 
 
 
+class TimedCache:
+    '''
+    Value computed by load the first time it is needed, rather than at
+    import, and reloaded once it is older than seconds.
+    '''
+
+    def __init__(self, load, seconds):
+        self.load = load
+        self.seconds = seconds
+        self.value = None
+        self.loaded = None
+
+    def get(self):
+
+        now = datetime.now()
+        if self.loaded is None or \
+                (now - self.loaded).total_seconds() > self.seconds:
+            self.value = self.load()
+            self.loaded = now
+
+        return self.value
+
+
+# reload the vocabulary this often, to pick up other workers' additions
+CM_REFRESH_SECONDS = 600
+# distinct conceptual metaphors in use; see previously_used_cm
+PREVIOUSLY_USED_CM = TimedCache(
+    lambda: models.Facet.conceptual_metaphors(), CM_REFRESH_SECONDS
+)
+
+
 def previously_used_cm():
-    facets = [facet
-              for project in models.Project.objects
-              for facet in project.facets]
+    '''
+    Conceptual metaphors used in any instance so far. Computed by the
+    database with a distinct query the first time it is needed, then kept
+    up to date by add_used_cm and reloaded every CM_REFRESH_SECONDS.
+    '''
+    return PREVIOUSLY_USED_CM.get()
 
-    instances = [instance for facet in facets for instance in facet.instances]
 
-    conceptual_metaphors = list(set(
-        i['conceptual_metaphor'].lower().strip() for i in instances
-        if i['conceptual_metaphor'] != ''
-    ))
+def add_used_cm(cm):
+    '''
+    Record a conceptual metaphor just saved with an instance.
+    '''
+    cm = (cm or '').lower().strip()
+    used = PREVIOUSLY_USED_CM.value
+    if cm and used is not None and cm not in used:
+        used.append(cm)
+
+
+# log entries per page of the dashboard
+DASHBOARD_LOG_ENTRIES = 10
+
+# project summaries shown on the dashboard, reloaded this often; see
+# get_project_summaries
+PROJECT_SUMMARY_SECONDS = 30
+PROJECT_SUMMARIES = TimedCache(
+    lambda: models.Project.summaries(), PROJECT_SUMMARY_SECONDS
+)
+
+# instances shown per page of the facet view, by default and at most
+FACET_PAGE_SIZE = 50
+MAX_FACET_PAGE_SIZE = 500
+
+# IatvDocument fields shown with each instance in the facet view
+DISPLAY_DOCUMENT_FIELDS = [
+    'network', 'program_name', 'start_localtime', 'iatv_url'
+]
+
+# process-level (project_id, facet_word) -> facet id index; see find_facet
+FACET_INDEX = {}
+
+
+def index_project_facets(project_id):
+    '''
+    Add every facet of a project to FACET_INDEX with a single query that
+    only loads facet words. Aborts with 404 if the project does not exist.
+    '''
+    facet_ids = models.Project.get_facet_ids(project_id)
+    if facet_ids is None:
+        abort(404)
+
+    for facet in models.Facet.objects(
+                pk__in=facet_ids
+            ).only('word').as_pymongo():
+        FACET_INDEX[(str(project_id), facet['word'])] = facet['_id']
+
+
+def invalidate_facet_index(project_id=None):
+    '''
+    Drop cached facet ids for one project, or for all projects if
+    project_id is None.
+    '''
+    if project_id is None:
+        FACET_INDEX.clear()
+        return
+
+    for key in [key for key in FACET_INDEX if key[0] == str(project_id)]:
+        FACET_INDEX.pop(key, None)
+
+
+def find_facet(project_id, facet_word, **fields):
+    '''
+    Fetch the single facet of a project with word facet_word, using
+    FACET_INDEX to avoid loading the project's other facets. fields, if
+    given, is passed to QuerySet.fields to load only part of the facet.
+
+    A stale index entry, e.g. for a deleted or renamed facet, fails to match
+    and the project is re-indexed once before aborting with 404.
+    '''
+    key = (str(project_id), facet_word)
+
+    for _ in range(2):
+        if key not in FACET_INDEX:
+            index_project_facets(project_id)
+        if key not in FACET_INDEX:
+            abort(404)
+
+        query = models.Facet.objects(pk=FACET_INDEX[key], word=facet_word)
+        if fields:
+            query = query.fields(**fields)
+
+        facet = query.first()
+        if facet is not None:
+            return facet
+
+        invalidate_facet_index(project_id)
+
+    abort(404)
+
+
+def get_facet(project_id, facet_word, instance_idx=None, n_instances=1):
+    '''
+    Fetch a project's facet with word facet_word; see find_facet. If
+    instance_idx is given, only n_instances instances starting there are
+    loaded, from facet.instances[0].
+    '''
+    if instance_idx is None:
+        return find_facet(project_id, facet_word)
+
+    # only the word and the sliced instances are loaded
+    return find_facet(
+        project_id, facet_word,
+        word=1, slice__instances=[instance_idx, n_instances]
+    )
+
+
+def get_facet_id(project_id, facet_word):
+    '''
+    Id of a project's facet with word facet_word, checked against the
+    database without loading any of its instances; see find_facet.
+    '''
+    return find_facet(project_id, facet_word, id=1).pk
+
+
+def get_facet_page(project_id, facet_word):
+    '''
+    One page of a facet's instances, as selected by the page and per_page
+    query parameters, with the display fields of their source documents.
+
+    Returns:
+        (dict) facet, with only the page's instances loaded; documents,
+            display fields keyed by document id; page; per_page; offset,
+            the index of the first instance on the page; total_instances
+    '''
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(
+        max(request.args.get('per_page', FACET_PAGE_SIZE, type=int), 1),
+        MAX_FACET_PAGE_SIZE
+    )
+    offset = (page - 1) * per_page
+
+    facet = get_facet(project_id, facet_word, offset, per_page)
+
+    return dict(
+        facet=facet,
+        documents=get_display_documents(
+            set(instance.source_id for instance in facet.instances)
+        ),
+        page=page,
+        per_page=per_page,
+        offset=offset,
+        total_instances=models.Facet.count_instances(facet.pk)
+    )
+
+
+def get_display_documents(source_ids):
+    '''
+    Fields of IatvDocuments shown alongside their instances, fetched with a
+    single query that leaves out document_data and raw_srt.
+    '''
+    return dict(
+        (doc['_id'], doc) for doc in models.IatvDocument.objects(
+            pk__in=list(source_ids)
+        ).only(*DISPLAY_DOCUMENT_FIELDS).as_pymongo()
+    )
+
+
+def get_project_summaries():
+    '''
+    Summaries of all projects for the dashboard, as from
+    models.Project.summaries, reloaded at most every PROJECT_SUMMARY_SECONDS.
+    '''
+    return PROJECT_SUMMARIES.get()
+
+
+def format_log_cursor(cursor):
+    '''
+    Query string form of a (time_posted, id) log cursor.
+    '''
+    time_posted, log_id = cursor
+    return '{}_{}'.format(time_posted.isoformat(), log_id)
 
-    return conceptual_metaphors
 
+def parse_log_cursor(cursor):
+    '''
+    Inverse of format_log_cursor. Raises ValueError if malformed.
+    '''
+    time_posted, _, log_id = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(time_posted), ObjectId(log_id)
+    except (InvalidId, TypeError):
+        raise ValueError('invalid log cursor {!r}'.format(cursor))
+
+
+def get_project_summary(project_id):
+    '''
+    Project with only the fields needed for display, not its facets.
+    '''
+    return models.Project.objects(
+        pk=project_id
+    ).only('name', 'last_modified').get()
+
+
+@app.cli.command('merge-duplicate-documents')
+def merge_duplicate_documents():
+    '''
+    Merge IatvDocuments sharing an iatv_id and create the unique index.
+    '''
+    models.IatvDocument.merge_duplicates(verbose=True)
+
+
+@app.cli.command('recount-facet-progress')
+def recount_facet_progress():
+    '''
+    Recompute every facet's instance and flag counters from its instances.
+    '''
+    n_repaired = models.Facet.recount_progress(verbose=True)
+    print('repaired counters of {} facets'.format(n_repaired))
 
-PREVIOUSLY_USED_CM = previously_used_cm()
 
 user_datastore = MongoEngineUserDatastore(db, models.User, models.Role)
 security = Security(app, user_datastore)
@@ -54,9 +294,19 @@ def logout():
 @app.route('/', methods=['GET', 'POST'])
 @login_required
 def hello():
-    projects = models.Project.objects
-    log = list(models.Log.objects)[-10:]
-    log.reverse()
+    projects = get_project_summaries()
+
+    before = request.args.get('before')
+    if before is not None:
+        try:
+            before = parse_log_cursor(before)
+        except ValueError:
+            abort(400)
+
+    log, next_cursor = models.Log.recent(DASHBOARD_LOG_ENTRIES, before)
+    older_url = None
+    if next_cursor is not None:
+        older_url = url_for('hello', before=format_log_cursor(next_cursor))
 
     form = LogForm()
 
@@ -69,7 +319,8 @@ def hello():
 
         return redirect('/')
 
-    return render_template('index.html', projects=projects, log=log, form=form)
+    return render_template('index.html', projects=projects, log=log,
+                           older_url=older_url, form=form)
 
 
 class LogForm(FlaskForm):
@@ -80,8 +331,18 @@ class LogForm(FlaskForm):
 @login_required
 def project(project_id):
 
-    project = models.Project.objects.get(pk=project_id)
-    facets = project.facets
+    project = get_project_summary(project_id)
+
+    # only the counters of each facet, never its instances
+    facet_ids = models.Project.get_facet_ids(project.pk)
+    by_id = dict(
+        (facet['_id'], facet) for facet in models.Facet.objects(
+            pk__in=facet_ids
+        ).only(
+            'word', 'total_count', *models.INSTANCE_FLAG_COUNTERS.values()
+        ).as_pymongo()
+    )
+    facets = [by_id[facet_id] for facet_id in facet_ids if facet_id in by_id]
 
     return render_template('project.html',
                            facets=facets,
@@ -92,16 +353,52 @@ def project(project_id):
 @login_required
 def facet(project_id, facet_word):
 
-    project = models.Project.objects.get(pk=project_id)
-    facet = [f for f in project.facets if facet_word == f['word']][0]
-    iatv_documents = [
-        models.IatvDocument.objects.get(pk=instance.source_id)
-        for instance in facet.instances
-    ]
+    project = get_project_summary(project_id)
+    facet_page = get_facet_page(project_id, facet_word)
+    if not facet_page['facet'].instances and facet_page['page'] > 1:
+        abort(404)
 
-    return render_template('facet.html',
-                           project=project, facet=facet,
-                           iatv_documents=iatv_documents)
+    return render_template('facet.html', project=project, **facet_page)
+
+
+@app.route('/api/projects/<project_id>/facets/<facet_word>')
+@login_required
+def api_facet_page(project_id, facet_word):
+    '''
+    A page of a facet's instances as JSON, for loading further pages into
+    the facet view. html is the page rendered as in the facet view.
+    '''
+    project = get_project_summary(project_id)
+    facet_page = get_facet_page(project_id, facet_word)
+    facet = facet_page['facet']
+    documents = facet_page['documents']
+
+    instances = []
+    for idx, instance in enumerate(facet.instances, facet_page['offset']):
+        data = json.loads(instance.to_json())
+        data['index'] = idx
+
+        doc = documents.get(instance.source_id)
+        if doc is not None:
+            data['document'] = dict(
+                (field, doc.get(field)) for field in DISPLAY_DOCUMENT_FIELDS
+            )
+            if data['document']['start_localtime'] is not None:
+                data['document']['start_localtime'] = \
+                    data['document']['start_localtime'].isoformat()
+
+        instances.append(data)
+
+    return jsonify(dict(
+        page=facet_page['page'],
+        per_page=facet_page['per_page'],
+        total_instances=facet_page['total_instances'],
+        has_next=(facet_page['offset'] + len(instances) <
+                  facet_page['total_instances']),
+        instances=instances,
+        html=render_template('facet_instances.html', project=project,
+                             **facet_page)
+    ))
 
 
 @app.route('/api/projects/<project_id>/facets/<facet_word>/instances/<int:instance_idx>',
@@ -109,31 +406,53 @@ def facet(project_id, facet_word):
 @login_required
 def api_update_instance(project_id, facet_word, instance_idx):
 
-    project = models.Project.objects.get(pk=project_id)
-    facet = [f for f in project.facets if facet_word == f['word']][0]
+    project = get_project_summary(project_id)
+    facet = get_facet(project_id, facet_word, instance_idx)
+    if not facet.instances:
+        abort(404)
 
-    instance = facet.instances[instance_idx]
+    instance = facet.instances[0]
 
     if request.method == 'POST':
 
         data = request.form
 
         try:
-            instance.figurative = data['figurative'] == 'True'
-            instance.include = data['include'] == 'True'
-            instance.spoken_by = data['spoken_by']
-            instance.conceptual_metaphor = data['conceptual_metaphor']
-            instance.objects = data['objects']
-            instance.subjects = data['subjects']
-            instance.description = data['description']
-            instance.tense = data['tense']
-            instance.active_passive = data['active_passive']
-            instance.repeat = data['repeat'] == 'True'
+            fields = dict(
+                figurative=data['figurative'] == 'True',
+                include=data['include'] == 'True',
+                spoken_by=data['spoken_by'],
+                conceptual_metaphor=data['conceptual_metaphor'],
+                objects=data['objects'],
+                subjects=data['subjects'],
+                description=data['description'],
+                tense=data['tense'],
+                active_passive=data['active_passive'],
+                repeat=data['repeat'] == 'True',
+                rerun=data['rerun'] == 'True',
+                reviewed=True
+            )
             ri = data['repeat_index']
             if ri != '' and ri is not None:
-                instance.repeat_index = int(ri)
-            instance.rerun = data['rerun'] == 'True'
-            instance.save()
+                fields['repeat_index'] = int(ri)
+
+            # clients that send the version they read get conflict detection
+            version = data.get('version', '')
+            expected_version = int(version) if version != '' else None
+
+            modified = datetime.now()
+            instance = models.Facet.update_instance(
+                facet.pk, instance_idx, fields,
+                expected_version=expected_version, modified=modified
+            )
+            project.touch(modified)
+            add_used_cm(fields['conceptual_metaphor'])
+
+        except models.VersionConflict:
+            current = models.Facet.get_instance(facet.pk, instance_idx)
+            response = jsonify(json.loads(current.to_json()))
+            response.status_code = 409
+            return response
 
         except Exception as e:
             print(e)
@@ -141,15 +460,76 @@ def api_update_instance(project_id, facet_word, instance_idx):
     return jsonify(json.loads(instance.to_json()))
 
 
+@app.route('/api/projects/<project_id>/facets/<facet_word>/instances:batch',
+           methods=['POST'])
+@login_required
+def api_batch_update_instances(project_id, facet_word):
+    '''
+    Update many instances of a facet in one request. The JSON body is
+    {"patches": [{"idx": 3, "fields": {"rerun": true}, "version": 2}, ...],
+    "atomic": false}; version is optional. With atomic true, either every
+    patch is applied or none is.
+
+    Requests with a patch whose fields are empty or name a field clients
+    may not set, see models.EDITABLE_INSTANCE_FIELDS, are rejected with 400.
+    Otherwise responds with a result per patch, in order; see
+    models.Facet.update_instances. Atomic batches that fail respond 409 if
+    a patch conflicted and 400 otherwise.
+    '''
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = dict(patches=data)
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('patches'), list) or \
+            not all(isinstance(p, dict) for p in data['patches']) or \
+            not all(isinstance(p.get('fields'), dict) and p['fields']
+                    for p in data['patches']):
+        abort(400)
+
+    # the quote, its source and the edit bookkeeping are not for clients
+    read_only = set(models.Instance._fields) - \
+        set(models.EDITABLE_INSTANCE_FIELDS)
+    if any(read_only & set(p['fields']) for p in data['patches']):
+        abort(400)
+
+    atomic = bool(data.get('atomic', False))
+
+    project = get_project_summary(project_id)
+    facet_id = get_facet_id(project_id, facet_word)
+
+    modified = datetime.now()
+    results = models.Facet.update_instances(
+        facet_id, data['patches'], atomic=atomic, modified=modified
+    )
+
+    n_updated = sum(1 for r in results if r['status'] == 'updated')
+    if n_updated:
+        project.touch(modified)
+        for result, patch in zip(results, data['patches']):
+            if result['status'] == 'updated':
+                add_used_cm(
+                    (patch.get('fields') or {}).get('conceptual_metaphor')
+                )
+
+    response = jsonify(dict(results=results, n_updated=n_updated))
+    if atomic and not n_updated and results:
+        statuses = set(r['status'] for r in results)
+        response.status_code = 409 if 'conflict' in statuses else 400
+
+    return response
+
+
 @app.route('/projects/<project_id>/facets/<facet_word>/instances/<int:instance_idx>', methods=['GET', 'POST'])
 @login_required
 def edit_instance(project_id, facet_word, instance_idx):
 
-    project = models.Project.objects.get(pk=project_id)
-    facet = [f for f in project.facets if facet_word == f['word']][0]
+    project = get_project_summary(project_id)
+    facet = get_facet(project_id, facet_word, instance_idx)
+    if not facet.instances:
+        abort(404)
 
-    instance = facet.instances[instance_idx]
-    total_instances = len(facet.instances)
+    instance = facet.instances[0]
+    total_instances = models.Facet.count_instances(facet.pk)
 
     source_doc = models.IatvDocument.objects.get(pk=instance.source_id)
 
@@ -177,26 +557,31 @@ def edit_instance(project_id, facet_word, instance_idx):
         ap = form.active_passive.data
         desc = form.description.data
 
-        instance['spoken_by'] = sp_by
-        instance['conceptual_metaphor'] = cm
-        instance['figurative'] = fig
-        instance['include'] = inc
-        instance['objects'] = obj
-        instance['subjects'] = subj
-
         try:
             t = form.tense.data
-            instance['tense'] = t
         except:
-            instance['tense'] = ''
-
-        instance['active_passive'] = ap
-        instance['description'] = desc
-
-        instance.save()
-
-        if cm not in PREVIOUSLY_USED_CM:
-            PREVIOUSLY_USED_CM.append(cm)
+            t = ''
+
+        modified = datetime.now()
+        models.Facet.update_instance(
+            facet.pk, instance_idx,
+            dict(
+                spoken_by=sp_by,
+                conceptual_metaphor=cm,
+                figurative=fig,
+                include=inc,
+                objects=obj,
+                subjects=subj,
+                tense=t or '',
+                active_passive=ap,
+                description=desc,
+                reviewed=True
+            ),
+            modified=modified
+        )
+        project.touch(modified)
+
+        add_used_cm(cm)
 
         next_url = url_for(
                'edit_instance', project_id=project_id, facet_word=facet_word,
@@ -219,7 +604,7 @@ def get_conceptual_metaphors():
     route later for more refined requests if necessary.
     '''
 
-    return jsonify({'conceptual_metaphors': PREVIOUSLY_USED_CM})
+    return jsonify({'conceptual_metaphors': previously_used_cm()})
 
 
 class EditInstanceForm(FlaskForm):
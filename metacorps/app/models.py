@@ -1,14 +1,44 @@
-import json
-import numpy as np
-import os
-import requests
+import mongoengine as db
+import time
 
 from datetime import datetime
-from flask_security import UserMixin, RoleMixin
+from functools import lru_cache
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
 
-from .app import db
+try:
+    from flask_security import UserMixin, RoleMixin
+except ImportError:
+    # offline analysis does not need the web app's login support
+    UserMixin = RoleMixin = object
 
-DOWNLOAD_BASE_URL = 'https://archive.org/download/'
+from .video import DOWNLOAD_BASE_URL, SegmentDownloader
+
+# number of search results upserted per bulk write when ingesting
+DEFAULT_INGEST_BATCH_SIZE = 500
+
+# Instance flags whose number of true values is kept on the Facet
+INSTANCE_FLAG_COUNTERS = {
+    'reviewed': 'number_reviewed',
+    'include': 'number_included',
+    'figurative': 'number_figurative',
+    'rerun': 'number_rerun',
+}
+
+# Instance fields annotators may change through update_instance(s); the
+# quote, its source and the edit bookkeeping are only set by the server
+EDITABLE_INSTANCE_FIELDS = (
+    'figurative', 'include', 'conceptual_metaphor', 'objects', 'subjects',
+    'active_passive', 'tense', 'description', 'spoken_by', 'repeat',
+    'repeat_index', 'rerun', 'reviewed', 'reference_url'
+)
+
+
+class VersionConflict(RuntimeError):
+    '''
+    Raised when an instance was changed by someone else since it was read.
+    '''
+    pass
 
 
 class Instance(db.EmbeddedDocument):
@@ -40,13 +70,348 @@ class Instance(db.EmbeddedDocument):
 
     reference_url = db.URLField()
 
+    # When this instance was last edited by an annotator
+    last_modified = db.DateTimeField()
+    # Incremented on every edit for optimistic concurrency control
+    version = db.IntField(default=0)
+
 
 class Facet(db.Document):
 
     instances = db.ListField(db.EmbeddedDocumentField(Instance))
     word = db.StringField()
     total_count = db.IntField(default=0)
+
+    # number of instances with each flag set, kept current with $inc by
+    # update_instance(s); see INSTANCE_FLAG_COUNTERS and recount_progress
     number_reviewed = db.IntField(default=0)
+    number_included = db.IntField(default=0)
+    number_figurative = db.IntField(default=0)
+    number_rerun = db.IntField(default=0)
+
+    # When any of this facet's instances was last edited; used to export
+    # only facets changed since a previous export
+    last_modified = db.DateTimeField(default=datetime.now)
+
+    @classmethod
+    def from_search_results(cls, word, search_results, iatv_ids):
+        '''
+        Create and save a facet with one instance per search result.
+
+        Arguments:
+            word (str): facet label
+            search_results (list): iatv search results
+            iatv_ids (dict): iatv_id -> IatvDocument id lookup covering every
+                search result, as from IatvDocument.bulk_upsert_search_results
+        '''
+        instances = [
+            Instance(text=res['snip'], source_id=iatv_ids[res['identifier']])
+            for res in search_results
+        ]
+
+        new_facet = cls(
+            instances=instances, word=word, total_count=len(instances)
+        )
+        new_facet.save()
+
+        return new_facet
+
+    @classmethod
+    def recount_progress(cls, facet_ids=None, verbose=False):
+        '''
+        Recompute total_count and the flag counters of facets from their
+        instances with one aggregation, and write any that drifted.
+
+        Arguments:
+            facet_ids (list): facets to repair; all facets if None
+            verbose (bool): print each repaired facet
+
+        Returns:
+            (int) number of facets whose counters were corrected
+        '''
+        collection = cls._get_collection()
+        match = {} if facet_ids is None else {'_id': {'$in': list(facet_ids)}}
+
+        group = {'_id': '$_id', 'total_count': {'$sum': 1}}
+        for flag, counter in INSTANCE_FLAG_COUNTERS.items():
+            group[counter] = {'$sum': {
+                '$cond': [{'$eq': ['$instances.' + flag, True]}, 1, 0]
+            }}
+
+        counts = dict(
+            (res.pop('_id'), res) for res in collection.aggregate([
+                {'$match': match},
+                {'$project': {'instances': 1}},
+                {'$unwind': '$instances'},
+                {'$group': group},
+            ])
+        )
+
+        fields = ['total_count'] + list(INSTANCE_FLAG_COUNTERS.values())
+        zeros = dict((field, 0) for field in fields)
+
+        requests = []
+        for stored in collection.find(match, dict((f, 1) for f in fields)):
+            # facets without instances are dropped by $unwind
+            actual = counts.get(stored['_id'], zeros)
+            if any(stored.get(f) != actual[f] for f in fields):
+                requests.append(UpdateOne(
+                    {'_id': stored['_id']}, {'$set': actual}
+                ))
+                if verbose:
+                    print('facet {}: {}'.format(stored['_id'], actual))
+
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+
+        return len(requests)
+
+    @classmethod
+    def get_instance(cls, facet_id, instance_idx):
+        '''
+        Load only one embedded instance of a facet using `$slice`.
+
+        Returns:
+            (Instance) or None if the facet or instance does not exist
+        '''
+        raw = cls.objects(pk=facet_id).fields(
+            slice__instances=[instance_idx, 1]
+        ).as_pymongo().first()
+
+        if raw is None or not raw.get('instances') or instance_idx < 0:
+            return None
+
+        return Instance._from_son(raw['instances'][0])
+
+    @classmethod
+    def conceptual_metaphors(cls):
+        '''
+        Distinct conceptual metaphors of all instances, lowercased and
+        stripped. The distinct values are found by the database, so no
+        facet is loaded.
+        '''
+        values = cls._get_collection().distinct(
+            'instances.conceptual_metaphor'
+        )
+
+        return sorted(set(
+            v.lower().strip() for v in values if v and v.strip()
+        ))
+
+    @classmethod
+    def count_instances(cls, facet_id):
+        '''
+        Number of instances in a facet, counted by the database.
+        '''
+        res = list(cls._get_collection().aggregate([
+            {'$match': {'_id': facet_id}},
+            {'$project': {'n': {'$size': {'$ifNull': ['$instances', []]}}}}
+        ]))
+
+        return res[0]['n'] if res else 0
+
+    @classmethod
+    def update_instance(cls, facet_id, instance_idx, fields,
+                        expected_version=None, modified=None, retries=3):
+        '''
+        Atomically update fields of one embedded instance with a positional
+        `$set` on instances.<instance_idx>.<field>, instead of re-saving the
+        facet's whole instances array. Only fields whose values change are
+        written, the facet's flag counters are kept current with `$inc`,
+        and the instance's version is incremented.
+
+        The update only applies if the instance's version is unchanged since
+        it was read. If expected_version is given it must match the stored
+        version; otherwise a concurrent change is retried up to retries
+        times.
+
+        Arguments:
+            facet_id (ObjectId): id of the facet holding the instance
+            instance_idx (int): index of the instance in facet.instances
+            fields (dict): new values keyed by names from
+                EDITABLE_INSTANCE_FIELDS
+            expected_version (int): version the client last read
+            modified (datetime.datetime): modification time to record
+
+        Returns:
+            (Instance) the updated instance
+
+        Raises:
+            IndexError: no such facet or instance
+            VersionConflict: the instance changed concurrently
+            ValueError: fields names a field that is not editable
+            mongoengine.ValidationError: a value is invalid for its field
+        '''
+        mongo_fields = _instance_mongo_fields(fields)
+
+        modified = modified or datetime.now()
+        collection = cls._get_collection()
+
+        for _ in range(retries):
+            current = cls.get_instance(facet_id, instance_idx)
+            if current is None:
+                raise IndexError(
+                    'no instance {} in facet {}'.format(instance_idx, facet_id)
+                )
+
+            version = current.version or 0
+            if expected_version is not None and expected_version != version:
+                raise VersionConflict(
+                    'instance {} is at version {}, not {}'.format(
+                        instance_idx, version, expected_version
+                    )
+                )
+
+            query = {'_id': facet_id}
+            to_set = {'last_modified': modified}
+            to_inc = {}
+            _add_instance_update(query, to_set, to_inc, instance_idx,
+                                 mongo_fields, current.to_mongo(), modified)
+
+            res = collection.find_one_and_update(
+                query, {'$set': to_set, '$inc': to_inc},
+                projection={'instances': {'$slice': [instance_idx, 1]}},
+                return_document=ReturnDocument.AFTER
+            )
+
+            if res is not None:
+                return Instance._from_son(res['instances'][0])
+
+            if expected_version is not None:
+                break
+
+        raise VersionConflict(
+            'instance {} of facet {} changed concurrently'.format(
+                instance_idx, facet_id
+            )
+        )
+
+    @classmethod
+    def update_instances(cls, facet_id, patches, atomic=False, modified=None,
+                         retries=3):
+        '''
+        Apply many instance patches to one facet with a single update of
+        positional `$set`s, validating them all first. Each instance's
+        version is incremented and the facet's flag counters are kept
+        current, as in update_instance.
+
+        Patches that are invalid, name a missing instance, or whose
+        expected version is stale are reported and, unless atomic is True,
+        the rest are still applied. With atomic=True either every patch is
+        applied or none is.
+
+        Arguments:
+            facet_id (ObjectId): id of the facet holding the instances
+            patches (list): dicts with idx, the instance index, fields, a
+                dict of new values keyed by names from
+                EDITABLE_INSTANCE_FIELDS, and optionally version, the
+                version the client last read
+            atomic (bool): apply all patches or none
+            modified (datetime.datetime): modification time to record
+
+        Returns:
+            (list) one dict per patch, in order, with idx, status
+                ('updated', 'invalid', 'missing', 'conflict' or, in atomic
+                mode, 'not_applied'), and version or error
+        '''
+        modified = modified or datetime.now()
+        results = [dict(idx=patch.get('idx')) for patch in patches]
+
+        pending = {}
+        for result, patch in zip(results, patches):
+            idx = patch.get('idx')
+            try:
+                if type(idx) is not int or idx < 0:
+                    raise ValueError('idx must be a non-negative integer')
+                if idx in pending:
+                    raise ValueError('instance {} patched twice'.format(idx))
+                pending[idx] = (
+                    _instance_mongo_fields(patch.get('fields') or {}),
+                    patch.get('version'),
+                    result
+                )
+            except (ValueError, TypeError, db.ValidationError) as e:
+                result.update(status='invalid', error=str(e))
+
+        if atomic and len(pending) < len(patches):
+            return _not_applied(results)
+
+        # read only the stored values the patches compare against
+        collection = cls._get_collection()
+        projection = dict(
+            ('instances.' + key, 1)
+            for mongo_fields, _, _ in pending.values() for key in mongo_fields
+        )
+        projection['instances.version'] = 1
+        for flag in INSTANCE_FLAG_COUNTERS:
+            projection['instances.' + flag] = 1
+
+        for _ in range(retries):
+            if not pending:
+                break
+
+            raw = collection.find_one({'_id': facet_id}, projection)
+            current = raw.get('instances', []) if raw is not None else []
+
+            to_set = {'last_modified': modified}
+            to_inc = {}
+            query = {'_id': facet_id}
+            versions = {}
+
+            for idx in list(pending):
+                mongo_fields, expected_version, result = pending[idx]
+
+                if idx >= len(current):
+                    result.update(status='missing',
+                                  error='no instance {}'.format(idx))
+                    del pending[idx]
+                    continue
+
+                old = current[idx]
+                version = old.get('version') or 0
+                if expected_version is not None and \
+                        expected_version != version:
+                    result.update(
+                        status='conflict', version=version,
+                        error='instance is at version {}, not {}'.format(
+                            version, expected_version
+                        )
+                    )
+                    del pending[idx]
+                    continue
+
+                _add_instance_update(query, to_set, to_inc, idx,
+                                     mongo_fields, old, modified)
+                versions[idx] = version
+
+            if atomic and len(pending) < len(patches):
+                return _not_applied(results)
+            if not pending:
+                break
+
+            for counter in INSTANCE_FLAG_COUNTERS.values():
+                if to_inc.get(counter) == 0:
+                    del to_inc[counter]
+
+            # every patch is one write to the same facet, so it is applied
+            # completely or, if any version moved on, not at all
+            res = collection.update_one(
+                query, {'$set': to_set, '$inc': to_inc}
+            )
+            if res.matched_count:
+                for idx, version in versions.items():
+                    pending[idx][2].update(status='updated',
+                                           version=version + 1)
+                pending.clear()
+
+        for _, _, result in pending.values():
+            result.update(status='conflict',
+                          error='instance changed concurrently')
+
+        if atomic and any(r['status'] != 'updated' for r in results):
+            return _not_applied(results)
+
+        return results
 
 
 class Project(db.Document):
@@ -58,26 +423,105 @@ class Project(db.Document):
     created = db.DateTimeField(default=datetime.now)
     last_modified = db.DateTimeField(default=datetime.now)
 
-    def add_facet_from_search_results(self, facet_label, search_results):
+    def add_facet_from_search_results(self, facet_label, search_results,
+                                      batch_size=DEFAULT_INGEST_BATCH_SIZE,
+                                      verbose=False):
+        '''
+        Ingest search results in bulk as a new facet of this project.
 
-        instances = []
-        for res in search_results:
+        Arguments:
+            facet_label (str): word of the new facet
+            search_results (list): iatv search results
+            batch_size (int): number of documents upserted per bulk write
+            verbose (bool): print ingest throughput
 
-            doc = IatvDocument.from_search_result(res)
-            doc.save()
-            new_instance = Instance(doc.document_data, doc.id)
-            # new_instance.save()
-            instances.append(new_instance)
+        Returns:
+            (IngestStats) ingest counts and timing
+        '''
+        stats = IngestStats()
+        iatv_ids = IatvDocument.bulk_upsert_search_results(
+            search_results, batch_size=batch_size, stats=stats
+        )
 
-        new_facet = Facet(instances, facet_label, len(instances))
-        new_facet.save()
+        new_facet = Facet.from_search_results(
+            facet_label, search_results, iatv_ids
+        )
+        stats.finish(n_instances=len(new_facet.instances))
 
         self.facets.append(new_facet)
 
+        self.last_modified = datetime.now()
         self.save()
 
+        if verbose:
+            print(stats)
+
+        return stats
+
+    @classmethod
+    def get_facet_ids(cls, project_id):
+        '''
+        Ids of a project's facets read from the raw project document, so that
+        no Facet, and none of its embedded instances, is dereferenced.
+        Returns None if there is no such project.
+        '''
+        raw = cls.objects(pk=project_id).only('facets').as_pymongo().first()
+        if raw is None:
+            return None
+
+        return [getattr(ref, 'id', ref) for ref in raw.get('facets', [])]
+
+    @classmethod
+    def summaries(cls):
+        '''
+        Name, facet count, and total and flag counts of the instances of
+        every project, for listings. Reads facet ids from the raw project
+        documents and only the counters of the facets, with two queries and
+        no instances loaded.
+
+        Returns:
+            (list) dicts with id, name, n_facets, total_count and the
+                counters of INSTANCE_FLAG_COUNTERS, ordered by name
+        '''
+        projects = list(cls.objects.only('name', 'facets').as_pymongo())
+
+        facet_ids = [getattr(ref, 'id', ref)
+                     for project in projects
+                     for ref in project.get('facets', [])]
+        counters = ['total_count'] + list(INSTANCE_FLAG_COUNTERS.values())
+        counts = dict(
+            (facet['_id'], facet) for facet in Facet.objects(
+                pk__in=facet_ids
+            ).only(*counters).as_pymongo()
+        )
+
+        summaries = []
+        for project in projects:
+            facets = [counts.get(getattr(ref, 'id', ref), {})
+                      for ref in project.get('facets', [])]
+            summary = dict(
+                id=project['_id'],
+                name=project.get('name'),
+                n_facets=len(facets),
+            )
+            for counter in counters:
+                summary[counter] = sum(f.get(counter) or 0 for f in facets)
+            summaries.append(summary)
+
+        return sorted(summaries, key=lambda s: s['name'] or '')
+
+    def touch(self, modified=None):
+        '''
+        Record that annotations in this project changed. Analysis caches are
+        keyed on last_modified, so call this whenever an Instance is saved.
+        '''
+        self.last_modified = modified or datetime.now()
+        self.update(set__last_modified=self.last_modified)
+
     @classmethod
-    def from_search_results(cls, faceted_search_results, project_name):
+    def from_search_results(cls, faceted_search_results, project_name,
+                            batch_size=DEFAULT_INGEST_BATCH_SIZE,
+                            verbose=False):
         '''
         Arguments:
             faceted_search_results (dict): e.g.
@@ -86,31 +530,72 @@ class Project(db.Document):
                     'epa/strangle': [instance0, ...],
                     'regulations/rob': [...]
                 }
+            project_name (str): name of the new project
+            batch_size (int): number of documents upserted per bulk write
+            verbose (bool): print ingest throughput
+
+        Search results from all facets are ingested together, so a show hit
+        by several facets is stored once.
         '''
-        facets = []
+        stats = IngestStats()
+        iatv_ids = IatvDocument.bulk_upsert_search_results(
+            (res
+             for search_results in faceted_search_results.values()
+             for res in search_results),
+            batch_size=batch_size, stats=stats
+        )
 
-        for facet_label, search_results in faceted_search_results.items():
+        facets = [
+            Facet.from_search_results(facet_label, search_results, iatv_ids)
+            for facet_label, search_results in faceted_search_results.items()
+        ]
+        stats.finish(n_instances=sum(len(f.instances) for f in facets))
 
-            instances = []
-            for res in search_results:
-                doc = IatvDocument.from_search_result(res)
-                doc.save()
-                new_instance = Instance(doc.document_data, doc.id)
-                # new_instance.save()
-                instances.append(new_instance)
+        if verbose:
+            print(stats)
 
-            new_facet = Facet(instances, facet_label, len(instances))
-            new_facet.save()
-            facets.append(new_facet)
+        return cls(name=project_name, facets=facets)
 
-            instances = []
 
-        return cls(project_name, facets)
+class IngestStats:
+    '''
+    Counts and throughput of a bulk search result ingest.
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.seconds = None
+        self.n_results = 0
+        self.n_documents = 0
+        self.n_inserted = 0
+        self.n_batches = 0
+        self.n_instances = 0
+
+    def finish(self, n_instances=0):
+        self.n_instances = n_instances
+        self.seconds = time.time() - self.started
+
+    def __str__(self):
+        seconds = self.seconds or (time.time() - self.started)
+        return (
+            'ingested {} search results ({} unique documents, {} new) '
+            'in {} batches, {} instances, {:.2f}s ({:.0f} results/s)'
+        ).format(
+            self.n_results, self.n_documents, self.n_inserted,
+            self.n_batches, self.n_instances, seconds,
+            self.n_results / seconds if seconds else 0.0
+        )
+
+
+# set once the unique iatv_id index is known to exist; see
+# IatvDocument.ensure_iatv_id_index
+IATV_ID_INDEX_READY = False
 
 
 class IatvDocument(db.Document):
 
-    document_data = db.StringField(required=True)
+    # broadcast text; search hit snippets are kept on Instance.text instead
+    document_data = db.StringField()
     raw_srt = db.StringField()
     iatv_id = db.StringField(required=True)
     iatv_url = db.URLField(required=True)
@@ -125,7 +610,15 @@ class IatvDocument(db.Document):
     runtime_seconds = db.FloatField()
     utc_offset = db.StringField()
 
-    datetime_added = db.DateTimeField(default=datetime.now())
+    datetime_added = db.DateTimeField(default=datetime.now)
+
+    # One document per broadcast. The unique index is created on ingest by
+    # ensure_iatv_id_index rather than on first use, since it cannot be
+    # built while duplicates from before it existed remain.
+    meta = {
+        'indexes': [{'fields': ['iatv_id'], 'unique': True}],
+        'auto_create_index': False,
+    }
 
     @classmethod
     def from_search_result(cls, search_result):
@@ -134,54 +627,385 @@ class IatvDocument(db.Document):
         https://archive.org/details/tv?q=epa+kill&time=20151202-20170516&rows=10&output=json
         for an example search result that is parsed
         '''
-        sr = search_result
+        return cls(**_search_result_fields(search_result))
+
+    @classmethod
+    def get_or_create_from_search_result(cls, search_result):
+        '''
+        The stored document for a search result's broadcast, created with an
+        atomic upsert if there is none yet. Per-hit snippet text belongs on
+        the Instance, not on the shared document.
+        '''
+        cls.ensure_iatv_id_index()
+
+        query, update = cls._search_result_upsert(
+            search_result, datetime.now()
+        )
+        res = cls._get_collection().find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+        return cls._from_son(res)
+
+    @classmethod
+    def _search_result_upsert(cls, search_result, datetime_added):
+        '''
+        Query and update that insert the document for a search result's
+        broadcast unless one with its iatv_id is already stored.
+        '''
+        doc = cls.from_search_result(search_result)
+        doc.datetime_added = datetime_added
+        doc.validate()
+        son = doc.to_mongo()
+        son.pop('_id', None)
+
+        return {'iatv_id': doc.iatv_id}, {'$setOnInsert': son}
+
+    @classmethod
+    def ensure_iatv_id_index(cls):
+        '''
+        Create the unique iatv_id index that makes upserts safe against
+        concurrent ingests and serves iatv_id lookups. Checked once per
+        process; while documents from before the index existed are still
+        duplicated it cannot be built, and merge_duplicates must run first.
+
+        Returns:
+            (bool) whether the index exists
+        '''
+        global IATV_ID_INDEX_READY
+
+        if not IATV_ID_INDEX_READY:
+            try:
+                cls.ensure_indexes()
+                IATV_ID_INDEX_READY = True
+            except OperationFailure:
+                print('IatvDocuments share iatv_ids; run flask '
+                      'merge-duplicate-documents to merge them and create '
+                      'the unique index')
+
+        return IATV_ID_INDEX_READY
+
+    @classmethod
+    def merge_duplicates(cls, batch_size=DEFAULT_INGEST_BATCH_SIZE,
+                         verbose=False):
+        '''
+        Merge documents sharing an iatv_id into the oldest one, rewrite
+        Instance.source_id and IatvCorpus.documents references to point at
+        it with bulk writes, delete the duplicates, and create the unique
+        iatv_id index.
+
+        Arguments:
+            batch_size (int): number of duplicated iatv_ids handled per batch
+            verbose (bool): print progress
+
+        Returns:
+            (dict) counts of merged documents and rewritten references
+        '''
+        collection = cls._get_collection()
+        counts = dict(iatv_ids=0, documents_removed=0,
+                      instances_updated=0, corpora_updated=0)
+
+        groups = collection.aggregate([
+            {'$group': {'_id': '$iatv_id', 'ids': {'$push': '$_id'},
+                        'n': {'$sum': 1}}},
+            {'$match': {'n': {'$gt': 1}}}
+        ], allowDiskUse=True)
+
+        batch = []
+        for group in groups:
+            batch.append(group)
+            if len(batch) == batch_size:
+                _merge_duplicate_batch(collection, batch, counts)
+                batch = []
+                if verbose:
+                    print('merged {} duplicated iatv_ids'.format(
+                        counts['iatv_ids']
+                    ))
+        if batch:
+            _merge_duplicate_batch(collection, batch, counts)
+
+        cls.ensure_indexes()
+
+        if verbose:
+            print('merged {iatv_ids} duplicated iatv_ids, removed '
+                  '{documents_removed} documents, updated '
+                  '{instances_updated} instances and {corpora_updated} '
+                  'corpora'.format(**counts))
+
+        return counts
+
+    @classmethod
+    def bulk_upsert_search_results(cls, search_results,
+                                   batch_size=DEFAULT_INGEST_BATCH_SIZE,
+                                   stats=None):
+        '''
+        Store the documents for many search results with one bulk write of
+        upserts per batch, instead of one save per result. Results are
+        deduplicated by iatv_id first, and a document that already exists
+        for an iatv_id is re-used rather than duplicated.
+
+        Arguments:
+            search_results (iterable): iatv search results
+            batch_size (int): number of upserts per bulk write
+            stats (IngestStats): updated with counts if given
+
+        Returns:
+            (dict) iatv_id -> IatvDocument id for every search result
+        '''
+        cls.ensure_iatv_id_index()
+
+        unique_results = {}
+        n_results = 0
+        for res in search_results:
+            n_results += 1
+            unique_results.setdefault(res['identifier'], res)
+
+        collection = cls._get_collection()
+        now = datetime.now()
+
+        iatv_ids = {}
+        unique_ids = list(unique_results)
+        for start in range(0, len(unique_ids), batch_size):
+            batch = unique_ids[start:start + batch_size]
+
+            upserts = [
+                UpdateOne(
+                    *cls._search_result_upsert(unique_results[iatv_id], now),
+                    upsert=True
+                )
+                for iatv_id in batch
+            ]
+
+            res = collection.bulk_write(upserts, ordered=False)
+
+            for doc in collection.find({'iatv_id': {'$in': batch}},
+                                       {'iatv_id': 1}):
+                iatv_ids.setdefault(doc['iatv_id'], doc['_id'])
+
+            if stats is not None:
+                stats.n_inserted += res.upserted_count
+                stats.n_batches += 1
+
+        if stats is not None:
+            stats.n_results += n_results
+            stats.n_documents += len(unique_ids)
+
+        return iatv_ids
+
+    def download_video(self, download_dir, max_workers=4, concatenate=False,
+                       base_url=DOWNLOAD_BASE_URL, downloader=None):
+        '''
+        Download this broadcast as 60 second mp4 segments, several at a
+        time, skipping segments already downloaded.
 
-        document_data = sr['snip']
-        # eg WHO_20160108_113000_Today_in_Iowa_at_530
-        iatv_id = sr['identifier']
-        iatv_url = 'https://archive.org/details/' + iatv_id
+        Arguments:
+            download_dir (str): directory to write segments to
+            max_workers (int): number of concurrent segment downloads
+            concatenate (bool): also join the segments with ffmpeg
+            base_url (str): download server
+            downloader (video.SegmentDownloader): configured downloader to
+                use instead of a default one
 
-        id_spl = iatv_id.split('_')
+        Returns:
+            (list or str) segment paths, or joined video path
+        '''
+        if downloader is None:
+            downloader = SegmentDownloader(max_workers=max_workers)
 
-        network = id_spl[0]
+        return downloader.download(
+            self.iatv_id, self.runtime_seconds, download_dir,
+            base_url=base_url, concatenate=concatenate
+        )
 
-        program_name = ' '.join(id_spl[3:])
 
-        # eg 20160108
-        air_date_str = id_spl[1]
-        # eg 113000; UTC
-        air_time_str = id_spl[2]
+def _instance_mongo_fields(fields):
+    '''
+    Validate Instance field values and convert them to their stored form,
+    keyed by database field name.
 
-        start_localtime = datetime(
-                int(air_date_str[:4]),
-                int(air_date_str[4:6]),
-                int(air_date_str[6:]),
-                int(air_time_str[:2]),
-                int(air_time_str[2:4])
+    Raises:
+        ValueError: fields names an unknown Instance field or one not in
+            EDITABLE_INSTANCE_FIELDS
+        mongoengine.ValidationError: a value is invalid for its field
+    '''
+    unknown = set(fields) - set(Instance._fields)
+    if unknown:
+        raise ValueError(
+            'unknown Instance fields: {}'.format(sorted(unknown))
         )
 
-        return cls(document_data, iatv_id=iatv_id, iatv_url=iatv_url,
-                   network=network, program_name=program_name,
-                   start_localtime=start_localtime)
+    read_only = set(fields) - set(EDITABLE_INSTANCE_FIELDS)
+    if read_only:
+        raise ValueError(
+            'Instance fields not editable: {}'.format(sorted(read_only))
+        )
+
+    mongo_fields = {}
+    for name, value in fields.items():
+        field = Instance._fields[name]
+        if value is not None:
+            field.validate(value)
+        mongo_fields[field.db_field] = field.to_mongo(value)
+
+    return mongo_fields
 
-    def download_video(self, download_dir):
 
-        segments = int(np.ceil(self.runtime_seconds / 60.0))
+def _add_instance_update(query, to_set, to_inc, idx, mongo_fields, old,
+                         modified):
+    '''
+    Add the changes of one instance to an update of its facet: a positional
+    `$set` of the fields in mongo_fields that differ from old, the stored
+    fields of instance idx, increments of its version and of the facet's
+    flag counters, and a guard in query against a concurrent change.
+    '''
+    prefix = 'instances.{}.'.format(idx)
+    for key, value in mongo_fields.items():
+        if old.get(key) != value:
+            to_set[prefix + key] = value
+    to_set[prefix + 'last_modified'] = modified
+    to_inc[prefix + 'version'] = 1
+
+    for counter, delta in _flag_counter_deltas(mongo_fields, old).items():
+        to_inc[counter] = to_inc.get(counter, 0) + delta
+
+    # legacy instances may have no version stored at all
+    version = old.get('version') or 0
+    query[prefix + 'version'] = version if version else {'$in': [0, None]}
+
+
+def _flag_counter_deltas(mongo_fields, old):
+    '''
+    Changes to a facet's flag counters when an instance's stored fields old
+    are updated with mongo_fields; counters that do not change are left out.
+    '''
+    deltas = {}
+    for flag, counter in INSTANCE_FLAG_COUNTERS.items():
+        if flag in mongo_fields:
+            delta = int(bool(mongo_fields[flag])) - \
+                int(bool(old.get(flag, False)))
+            if delta:
+                deltas[counter] = delta
+
+    return deltas
+
+
+def _not_applied(results):
+    '''
+    Mark the patches of a failed atomic batch that had no error of their
+    own as not applied.
+    '''
+    for result in results:
+        if result.get('status') in (None, 'updated'):
+            result['status'] = 'not_applied'
+            result.pop('version', None)
+
+    return results
+
+
+def _merge_duplicate_batch(collection, groups, counts):
+    '''
+    Point references to duplicated IatvDocuments at the oldest document of
+    each group from the duplicate aggregation, then delete the others.
+    '''
+    remap = {}
+    for group in groups:
+        keep = min(group['ids'])
+        for doc_id in group['ids']:
+            if doc_id != keep:
+                remap[doc_id] = keep
+
+    dup_ids = list(remap)
+
+    facet_updates = []
+    for facet in Facet._get_collection().find(
+                {'instances.source_id': {'$in': dup_ids}},
+                {'instances.source_id': 1}
+            ):
+        to_set = dict(
+            ('instances.{}.source_id'.format(idx), remap[inst['source_id']])
+            for idx, inst in enumerate(facet['instances'])
+            if inst.get('source_id') in remap
+        )
+        counts['instances_updated'] += len(to_set)
+        facet_updates.append(
+            UpdateOne({'_id': facet['_id']}, {'$set': to_set})
+        )
 
-        for i in range(segments):
-            start_time = i * 60
-            stop_time = (i + 1) * 60
-            download_url = DOWNLOAD_BASE_URL + self.iatv_id + '/' +\
-                self.iatv_id + '.mp4?t=' + str(start_time) + '/' +\
-                str(stop_time) + '&exact=1&ignore=x.mp4'
+    if facet_updates:
+        Facet._get_collection().bulk_write(facet_updates, ordered=False)
 
-            res = requests.get(download_url)
+    corpus_updates = []
+    for corpus in IatvCorpus._get_collection().find(
+                {'documents': {'$in': dup_ids}}, {'documents': 1}
+            ):
+        documents = []
+        seen = set()
+        for doc_id in corpus['documents']:
+            doc_id = remap.get(doc_id, doc_id)
+            if doc_id not in seen:
+                seen.add(doc_id)
+                documents.append(doc_id)
+        corpus_updates.append(UpdateOne(
+            {'_id': corpus['_id']}, {'$set': {'documents': documents}}
+        ))
 
-            download_path = os.path.join(
-                download_dir, '{}_{}.mp4'.format(self.iatv_id, i))
+    if corpus_updates:
+        IatvCorpus._get_collection().bulk_write(corpus_updates, ordered=False)
+        counts['corpora_updated'] += len(corpus_updates)
 
-            with open(download_path, 'wb') as handle:
-                handle.write(res.content)
+    res = collection.delete_many({'_id': {'$in': dup_ids}})
+
+    counts['iatv_ids'] += len(groups)
+    counts['documents_removed'] += res.deleted_count
+
+
+@lru_cache(maxsize=65536)
+def parse_iatv_id(iatv_id):
+    '''
+    Parse network, program name and start time out of an iatv_id, e.g.
+    WHO_20160108_113000_Today_in_Iowa_at_530. Cached since the same show is
+    typically hit by many search results.
+
+    Returns:
+        (tuple) network, program_name, start_localtime
+    '''
+    id_spl = iatv_id.split('_')
+
+    network = id_spl[0]
+
+    program_name = ' '.join(id_spl[3:])
+
+    # eg 20160108
+    air_date_str = id_spl[1]
+    # eg 113000; UTC
+    air_time_str = id_spl[2]
+
+    start_localtime = datetime(
+            int(air_date_str[:4]),
+            int(air_date_str[4:6]),
+            int(air_date_str[6:]),
+            int(air_time_str[:2]),
+            int(air_time_str[2:4])
+    )
+
+    return network, program_name, start_localtime
+
+
+def _search_result_fields(search_result):
+    '''
+    IatvDocument field values for one iatv search result.
+    '''
+    # eg WHO_20160108_113000_Today_in_Iowa_at_530
+    iatv_id = search_result['identifier']
+    network, program_name, start_localtime = parse_iatv_id(iatv_id)
+
+    return dict(
+        iatv_id=iatv_id,
+        iatv_url='https://archive.org/details/' + iatv_id,
+        network=network,
+        program_name=program_name,
+        start_localtime=start_localtime
+    )
 
 
 class IatvCorpus(db.Document):
@@ -189,6 +1013,19 @@ class IatvCorpus(db.Document):
     name = db.StringField()
     documents = db.ListField(db.ReferenceField(IatvDocument))
 
+    @classmethod
+    def get_document_ids(cls, corpus_id):
+        '''
+        Ids of a corpus's documents read from the raw corpus document,
+        without dereferencing any IatvDocument. Returns None if there is no
+        such corpus.
+        '''
+        raw = cls.objects(pk=corpus_id).only('documents').as_pymongo().first()
+        if raw is None:
+            return None
+
+        return [getattr(ref, 'id', ref) for ref in raw.get('documents', [])]
+
 
 class Role(db.Document, RoleMixin):
     name = db.StringField(max_length=80, unique=True)
@@ -207,3 +1044,41 @@ class Log(db.Document):
     time_posted = db.DateTimeField(default=datetime.now)
     user_email = db.StringField()
     message = db.StringField()
+
+    meta = {
+        # newest first, with the id breaking ties between equal times
+        'indexes': [('-time_posted', '-_id')],
+    }
+
+    @classmethod
+    def recent(cls, limit=10, before=None):
+        '''
+        The newest log entries, optionally only those older than a cursor.
+        Served from the time_posted index, so the cost does not grow with
+        the size of the log.
+
+        Arguments:
+            limit (int): maximum number of entries
+            before (tuple): (time_posted, id) of the last entry of the
+                previous page, as returned in next_cursor
+
+        Returns:
+            (list, tuple) the entries, newest first, and the cursor of the
+                next, older, page, or None if there are no older entries
+        '''
+        query = cls.objects
+        if before is not None:
+            time_posted, log_id = before
+            query = cls.objects(
+                db.Q(time_posted__lt=time_posted) |
+                db.Q(time_posted=time_posted, id__lt=log_id)
+            )
+
+        entries = list(query.order_by('-time_posted', '-id').limit(limit + 1))
+
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = (entries[-1].time_posted, entries[-1].pk)
+
+        return entries, next_cursor
@@ -22,7 +22,14 @@ function editInstance(instanceIndex) {
         instanceData["repeat_index"] = ''
       }
 
+      if (instanceData["version"] === undefined) {
+        instanceData["version"] = 0
+      }
+
       var filledForm = 
+        '<input id="version" name="version" type="hidden" value="' +
+          instanceData["version"] + '">' +
+
         '<div class="row"><b>Figurative (check if yes)?</b>  <input ' + fig_checked + 
           ' id="figurative" name="figurative" type="checkbox" value="y"></div>' +
 
@@ -114,7 +121,8 @@ function freezeSaveUpdates(instanceIndex) {
     rerun: rerun,
     tense: $('#tense').val(),
     description: $('#description').val(),
-    active_passive: $('#active_passive').val()
+    active_passive: $('#active_passive').val(),
+    version: $('#version').val()
   };
 
   $.post(apiRoute, updatedData, (instanceData) => {
@@ -151,5 +159,11 @@ function freezeSaveUpdates(instanceIndex) {
       '<p><b>Description: </b>' + instanceData['description'] + '</p>' + 
       '<p><b>Tense: </b>' + instanceData['tense'] + '</p>' + 
       '<p><b>Active/Passive: </b>' + instanceData['active_passive'] + '</p>';
+  }).fail((xhr) => {
+    if (xhr.status === 409) {
+      alert('Instance ' + (instanceIndex + 1) + ' was changed by someone ' +
+            'else since you opened it. Reloading their changes.');
+      editInstance(instanceIndex);
+    }
   });
 }
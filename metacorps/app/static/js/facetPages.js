@@ -0,0 +1,22 @@
+/**
+ * Load further pages of a facet's instances into the facet view
+ */
+
+
+function loadMoreInstances(link) {
+
+  var apiRoute = '/api' + window.location.pathname;
+  var nextPage = parseInt(link.dataset.nextPage);
+
+  $.getJSON(apiRoute, {page: nextPage, per_page: link.dataset.perPage}).done(
+    (pageData) => {
+
+      $('#instances').append(pageData.html);
+
+      if (pageData.has_next) {
+        link.dataset.nextPage = nextPage + 1;
+      } else {
+        $(link).parent().remove();
+      }
+  });
+}
@@ -0,0 +1,225 @@
+'''
+video.py
+
+Download IATV broadcasts as fixed-length mp4 segments. Segments are fetched
+concurrently over a pooled HTTP session, streamed to disk, retried with
+exponential backoff, and written atomically so that an interrupted download
+can be resumed by skipping the segments already on disk.
+'''
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+DOWNLOAD_BASE_URL = 'https://archive.org/download/'
+
+
+def segment_url(base_url, iatv_id, start_time, stop_time):
+    '''
+    URL of the clip of broadcast iatv_id from start_time to stop_time,
+    both in seconds from the start of the broadcast.
+    '''
+    return base_url + iatv_id + '/' + iatv_id + '.mp4?t=' + \
+        str(start_time) + '/' + str(stop_time) + '&exact=1&ignore=x.mp4'
+
+
+class SegmentDownloader:
+
+    def __init__(self, max_workers=4, retries=3, backoff=1.0,
+                 chunk_size=64 * 1024, timeout=60, session=None):
+        '''
+        Arguments:
+            max_workers (int): maximum number of segments downloaded at once
+            retries (int): attempts per segment before giving up
+            backoff (float): seconds to wait after the first failed attempt,
+                doubled after each further failure
+            chunk_size (int): bytes read from the response at a time
+            timeout (float): connect and read timeout in seconds
+            session (requests.Session): session to use; by default one with
+                a connection pool of max_workers connections is created
+        '''
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        self.session = session
+
+    def download(self, iatv_id, runtime_seconds, download_dir,
+                 segment_seconds=60, base_url=DOWNLOAD_BASE_URL,
+                 concatenate=False, verify_existing=False):
+        '''
+        Download a whole broadcast as segments named <iatv_id>_<i>.mp4.
+
+        Arguments:
+            iatv_id (str): broadcast identifier
+            runtime_seconds (float): length of the broadcast
+            download_dir (str): directory to write segments to
+            segment_seconds (int): length of each segment
+            base_url (str): download server, e.g. a local stand-in for tests
+            concatenate (bool): also join the segments into <iatv_id>.mp4,
+                which requires ffmpeg
+            verify_existing (bool): re-download segments already on disk
+                whose size differs from the server's Content-Length;
+                otherwise any segment on disk is considered complete
+
+        Returns:
+            (list) segment paths in order, or the path of the joined video
+                if concatenate is True
+
+        Raises:
+            RuntimeError: if any segment failed after all retries
+        '''
+        os.makedirs(download_dir, exist_ok=True)
+
+        n_segments = int(-(-runtime_seconds // segment_seconds))
+        jobs = []
+        for i in range(n_segments):
+            url = segment_url(base_url, iatv_id, i * segment_seconds,
+                              (i + 1) * segment_seconds)
+            path = os.path.join(download_dir, '{}_{}.mp4'.format(iatv_id, i))
+            jobs.append((url, path))
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = dict(
+                (executor.submit(self.fetch_segment, url, path,
+                                 verify_existing), path)
+                for url, path in jobs
+            )
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append((futures[future], e))
+
+        if failed:
+            raise RuntimeError(
+                'failed to download {} of {} segments of {}: {}'.format(
+                    len(failed), n_segments, iatv_id,
+                    '; '.join('{} ({})'.format(p, e) for p, e in failed)
+                )
+            )
+
+        paths = [path for _, path in jobs]
+        if concatenate:
+            return concatenate_segments(
+                paths, os.path.join(download_dir, iatv_id + '.mp4')
+            )
+
+        return paths
+
+    def fetch_segment(self, url, path, verify_existing=False):
+        '''
+        Download url to path unless it is already there, retrying failures.
+        The response is streamed to a temporary file in chunks and renamed
+        into place only once complete.
+
+        Returns:
+            (bool) True if downloaded, False if skipped as already on disk
+        '''
+        if os.path.exists(path):
+            if not verify_existing:
+                return False
+            expected = self._content_length(url)
+            if expected is None or expected == os.path.getsize(path):
+                return False
+
+        for attempt in range(self.retries):
+            try:
+                self._stream_to(url, path)
+                return True
+            except (requests.RequestException, IOError):
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _stream_to(self, url, path):
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', suffix='.part'
+        )
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                with self.session.get(url, stream=True,
+                                      timeout=self.timeout) as res:
+                    res.raise_for_status()
+                    n_bytes = 0
+                    for chunk in res.iter_content(self.chunk_size):
+                        handle.write(chunk)
+                        n_bytes += len(chunk)
+
+                    expected = res.headers.get('Content-Length')
+                    if expected is not None and int(expected) != n_bytes:
+                        raise IOError(
+                            'truncated download of {}: {} of {} bytes'.format(
+                                url, n_bytes, expected
+                            )
+                        )
+
+            os.replace(tmp_path, path)
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _content_length(self, url):
+
+        try:
+            res = self.session.head(url, allow_redirects=True,
+                                    timeout=self.timeout)
+            res.raise_for_status()
+        except requests.RequestException:
+            return None
+
+        length = res.headers.get('Content-Length')
+
+        return int(length) if length is not None else None
+
+
+def concatenate_segments(segment_paths, output_path):
+    '''
+    Join mp4 segments into one video with ffmpeg's concat demuxer, without
+    re-encoding.
+
+    Returns:
+        (str) output_path
+    '''
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError('ffmpeg is required to concatenate segments')
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                     delete=False) as listing:
+        for path in segment_paths:
+            listing.write("file '{}'\n".format(
+                os.path.abspath(path).replace("'", "'\\''")
+            ))
+
+    try:
+        subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+             '-i', listing.name, '-c', 'copy', output_path],
+            check=True
+        )
+    finally:
+        os.remove(listing.name)
+
+    return output_path
@@ -0,0 +1,109 @@
+'''
+aggregation.py
+
+Daily metaphor counts computed inside MongoDB. Instead of exporting every
+instance of a project to pandas, the project's facets are unwound into
+instances, joined to their IatvDocuments with $lookup, and grouped by date
+and the requested columns with $group, so only the aggregated table is
+returned.
+'''
+import pandas as pd
+
+from .export_project import IATV_DOCUMENT_COLUMNS, INSTANCE_COLUMNS
+from metacorps.app.models import Facet, IatvDocument, Project
+
+
+def daily_counts_pipeline(facet_ids, by=None, included_only=True):
+    '''
+    Aggregation pipeline, run on the Facet collection, counting the
+    instances of the given facets per day of start_localtime and per value
+    of each column in by.
+
+    Arguments:
+        facet_ids (list): ids of the facets to count
+        by (list): exported column names to group by, e.g. ['network']
+        included_only (bool): count only instances marked include
+
+    Returns:
+        (list) the pipeline stages
+    '''
+    if by is None:
+        by = []
+
+    group_id = {
+        'start_localtime': {
+            '$dateToString': {
+                'format': '%Y-%m-%d', 'date': '$doc.start_localtime'
+            }
+        }
+    }
+    for column in by:
+        group_id[column] = _field_path(column)
+
+    pipeline = [
+        {'$match': {'_id': {'$in': list(facet_ids)}}},
+        {'$project': {'word': 1, 'instances': 1}},
+        {'$unwind': '$instances'},
+    ]
+    if included_only:
+        pipeline.append({'$match': {'instances.include': True}})
+
+    pipeline.extend([
+        {'$lookup': {
+            'from': IatvDocument._get_collection_name(),
+            'localField': 'instances.source_id',
+            'foreignField': '_id',
+            'as': 'doc',
+        }},
+        {'$unwind': '$doc'},
+        {'$group': {'_id': group_id, 'counts': {'$sum': 1}}},
+    ])
+
+    return pipeline
+
+
+def aggregate_daily_counts(project_name, by=None, included_only=True):
+    '''
+    Count a project's instances per day and per value of the columns in by.
+
+    Arguments:
+        project_name (str): name of the Project
+        by (list): exported column names to group by
+        included_only (bool): count only instances marked include
+
+    Returns:
+        (pandas.DataFrame) columns start_localtime (datetime.date), the
+            columns in by, and counts; one row per group
+    '''
+    if by is None:
+        by = []
+
+    project = Project.objects(name=project_name).only('id').get()
+    facet_ids = Project.get_facet_ids(project.pk)
+
+    groups = Facet._get_collection().aggregate(
+        daily_counts_pipeline(facet_ids, by, included_only=included_only)
+    )
+
+    columns = ['start_localtime'] + list(by)
+    rows = [
+        [group['_id'].get(column) for column in columns] + [group['counts']]
+        for group in groups
+    ]
+
+    ret = pd.DataFrame.from_records(rows, columns=columns + ['counts'])
+    ret['start_localtime'] = pd.to_datetime(ret.start_localtime).dt.date
+
+    return ret
+
+
+def _field_path(column):
+
+    if column in IATV_DOCUMENT_COLUMNS:
+        return '$doc.' + column
+    if column == 'facet_word':
+        return '$word'
+    if column in INSTANCE_COLUMNS:
+        return '$instances.' + column
+
+    raise ValueError('cannot group by unknown column {}'.format(column))
@@ -3,13 +3,19 @@ import numpy as np
 import os
 import pandas as pd
 
-from collections import OrderedDict, Counter
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
-from .export_project import ProjectExporter
-from metacorps.app.models import IatvCorpus
+from .aggregation import aggregate_daily_counts
+from .entities import EntityAliases
+from .export_cache import DEFAULT_CACHE_DIR, ExportCache
+from .export_project import (
+    DEFAULT_LOOKUP_BATCH_SIZE, EXPORT_COLUMNS, ProjectExporter
+)
+from .rollup import RollupCube
+from metacorps.app.models import IatvCorpus, IatvDocument
 
 
 DEFAULT_FACET_WORDS = [
@@ -25,8 +31,18 @@ DEFAULT_FACET_WORDS = [
     'slug',
 ]
 
+DEFAULT_NETWORKS = ['MSNBCW', 'CNNW', 'FOXNEWSW']
 
-def get_project_data_frame(project_name):
+# stored as category by normalize_data_frame
+LABEL_COLUMNS = ['network', 'facet_word', 'program_name']
+# free-text annotations, also lowercased and stripped
+ANNOTATION_COLUMNS = [
+    'subjects', 'objects', 'conceptual_metaphor', 'spoken_by', 'tense'
+]
+
+
+def get_project_data_frame(project_name, cache_dir=DEFAULT_CACHE_DIR,
+                           refresh=False, normalize=True, text=True):
     '''
     Convenience method for creating a newly initialized instance of the
     Analyzer class. Currently the only argument is year since the projects all
@@ -37,6 +53,13 @@ def get_project_data_frame(project_name):
     Arguments:
         project_name (str): name of project to be exported to an Analyzer
             with DataFrame representation included as an attribute
+        cache_dir (str): directory of the local export cache; exports are
+            re-used until the project is modified. None disables the cache
+        refresh (bool): re-export from MongoDB even if a cached export exists
+        normalize (bool): lowercase and strip the annotation columns and store
+            them and the label columns as category; see normalize_data_frame
+        text (bool): include the instance text column. Without it, text is
+            not even read from a cached export
     '''
     if type(project_name) is int:
         project_name = str('Viomet Sep-Nov ' + str(project_name))
@@ -45,69 +68,148 @@ def get_project_data_frame(project_name):
     if is_url(project_name) or os.path.exists(project_name):
         ret = pd.read_csv(project_name, na_values='',
                           parse_dates=['start_localtime'])
-        return ret
 
-    return ProjectExporter(project_name).export_dataframe()
+    elif cache_dir is None:
+        ret = ProjectExporter(project_name).export_dataframe()
 
+    else:
+        columns = None
+        if not text:
+            columns = [c for c in EXPORT_COLUMNS if c != 'text']
+        ret = ExportCache(cache_dir).get_dataframe(
+            project_name, refresh=refresh, columns=columns
+        )
 
-def _select_range_and_pivot_subj_obj(date_range, counts_df, subj_obj):
+    if not text and 'text' in ret:
+        ret = ret.drop(columns='text')
 
-    rng_sub = counts_df[
-        date_range[0] <= counts_df.start_localtime
-    ][
-        counts_df.start_localtime <= date_range[1]
-    ]
+    if normalize:
+        ret = normalize_data_frame(ret)
 
-    rng_sub_sum = rng_sub.groupby(['network', subj_obj]).agg(sum)
+    return ret
 
-    ret = rng_sub_sum.reset_index().pivot(
-        index='network', columns=subj_obj, values='counts'
-    )
 
-    return ret
+def normalize_data_frame(df):
+    '''
+    Lowercase and strip the annotation columns once, and store them and the
+    label columns as category, so that later grouping and string matching
+    work on the distinct values rather than on every row. Network, facet
+    word and program name keep their case.
 
+    Arguments:
+        df (pandas.DataFrame): exported project data
 
-def _count_daily_subj_obj(df, sub_obj):
+    Returns:
+        (pandas.DataFrame) a normalized copy of df
+    '''
+    df = df.copy()
 
-    subs = df[['start_localtime', 'network', 'subjects', 'objects']]
+    for column in LABEL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
 
-    subs.subjects = subs.subjects.map(lambda s: s.strip().lower())
-    subs.objects = subs.objects.map(lambda s: s.strip().lower())
+    for column in ANNOTATION_COLUMNS:
+        if column in df:
+            df[column] = _normalize_labels(df[column])
 
-    try:
-        trcl = subs[
-            (subs[sub_obj].str.contains('hillary clinton') |
-             subs[sub_obj].str.contains('donald trump')) &
-            subs[sub_obj].str.contains('/').map(lambda b: not b) &
-            subs[sub_obj].str.contains('campaign').map(lambda b: not b)
-        ]
-    except KeyError:
-        raise RuntimeError('sub_obj must be "subjects" or "objects"')
+    return df
 
-    c = trcl.groupby(['start_localtime', 'network', sub_obj]).size()
 
-    ret_df = c.to_frame()
-    ret_df.columns = ['counts']
-    ret_df.reset_index(inplace=True)
+def _normalize_labels(column):
+    '''
+    Categorical of the stripped, lowercased values of column. The strings
+    are only transformed once per distinct value.
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.codes.to_numpy()
+        uniques = column.cat.categories
+    else:
+        codes, uniques = pd.factorize(column)
 
-    # cleanup anything like 'republican nominee'
-    ret_df.loc[
-        :, sub_obj
-    ][
+    normalized = pd.Index(uniques, dtype=object).str.strip().str.lower()
+    categories = normalized.dropna().unique()
 
-        ret_df[sub_obj].str.contains('donald trump')
+    # missing values keep code -1, also when the column has no values
+    present = codes >= 0
+    new_codes = np.full(len(codes), -1, dtype=np.int64)
+    new_codes[present] = categories.get_indexer(normalized)[codes[present]]
 
-    ] = 'donald trump'
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, categories=categories),
+        index=column.index, name=column.name
+    )
 
-    ret_df.loc[
-        :, sub_obj
-    ][
 
-        ret_df[sub_obj].str.contains('hillary clinton')
+def daily_entity_counts(df, column='subjects', aliases=None):
+    '''
+    Daily counts of the entities mentioned in a subjects or objects column,
+    by network. Annotations are mapped to canonical entity names with one
+    pass over their distinct values, then counted in a single groupby.
+    df may also be a RollupCube with column among its dimensions, whose cells
+    are summed instead of counting every instance.
 
-    ] = 'hillary clinton'
+    Arguments:
+        df (pandas.DataFrame): exported project data, or a RollupCube of it
+        column (str): 'subjects' or 'objects'
+        aliases (entities.EntityAliases): entities to count; defaults to
+            Donald Trump and Hillary Clinton
 
-    return ret_df
+    Returns:
+        (pandas.DataFrame) counts indexed by a sorted DatetimeIndex of dates,
+            with (network, entity) columns
+    '''
+    if aliases is None:
+        aliases = EntityAliases()
+
+    if isinstance(df, RollupCube):
+        cells = df.counts(['date', 'network', column]).rename(
+            'counts'
+        ).reset_index()
+        dates = cells.date
+    else:
+        cells = df
+        dates = df.start_localtime.dt.normalize()
+
+    entity = aliases.canonicalize(_normalize_labels(cells[column]))
+    grouped = cells.groupby(
+        [dates.rename('date'),
+         cells.network.astype('category').rename('network'),
+         entity],
+        observed=True
+    )
+
+    if isinstance(df, RollupCube):
+        counts = grouped['counts'].sum()
+    else:
+        counts = grouped.size()
+
+    if counts.empty:
+        return pd.DataFrame(
+            index=pd.DatetimeIndex([], name='date'),
+            columns=pd.MultiIndex.from_arrays([[], []],
+                                              names=['network', column])
+        )
+
+    return counts.unstack(['network', column], fill_value=0).sort_index(
+        axis=1
+    )
+
+
+def entity_counts_in_range(daily_counts, date_range):
+    '''
+    Entity by network totals for the dates from date_range[0] to
+    date_range[-1] inclusive.
+
+    Arguments:
+        daily_counts (pandas.DataFrame): as from daily_entity_counts
+        date_range: pandas.DatetimeIndex or (start, end) pair
+
+    Returns:
+        (pandas.DataFrame) indexed by network with a column per entity
+    '''
+    in_range = daily_counts.loc[date_range[0]:date_range[-1]]
+
+    return in_range.sum().unstack(level=1, fill_value=0)
 
 
 def _count_by_start_localtime(df,
@@ -139,105 +241,141 @@ def _count_by_start_localtime(df,
     return ret_df
 
 
-def shows_per_date(date_index, iatv_corpus, by_network=False):
+def shows_per_date(date_index, iatv_corpus, by_network=False,
+                   use_cache=True):
     '''
     Arguments:
         date_index (pandas.DatetimeIndex): Full index of dates covered by
             data
         iatv_corpus (app.models.IatvCorpus): Obtained, e.g., using
-            `iatv_corpus = IatvCorpus.objects.get(name='Viomet Sep-Nov 2016')`
+            `iatv_corpus = IatvCorpus.objects.get(name='Viomet Sep-Nov 2016')`,
+            or the corpus name
         by_network (bool): whether or not to do a faceted daily count
             by network
+        use_cache (bool): reuse the counts of an earlier call for the same
+            corpus if its documents have not changed since
 
     Returns:
-        (pandas.Series) if by_network is False, (pandas.DataFrame)
-            if by_network is true.
+        (pandas.Series) if by_network is False, (pandas.DataFrame) with a
+            column for each network in the corpus if by_network is true.
     '''
     if type(iatv_corpus) is str:
-        iatv_corpus = IatvCorpus.objects(name=iatv_corpus)[0]
+        corpus_id = IatvCorpus.objects(name=iatv_corpus).only('id')[0].pk
+    else:
+        corpus_id = iatv_corpus.pk
 
-    docs = iatv_corpus.documents
+    document_ids = IatvCorpus.get_document_ids(corpus_id) or []
+    key = _corpus_documents_key(document_ids)
 
-    n_dates = len(date_index)
+    cached = SHOWS_PER_DATE_CACHE.get(corpus_id)
+    if use_cache and cached is not None and cached[0] == key:
+        counts = cached[1]
+    else:
+        counts = _count_shows(document_ids)
+        SHOWS_PER_DATE_CACHE[corpus_id] = (key, counts)
 
-    if not by_network:
+    if by_network:
+        return counts['by_network'].reindex(
+            index=date_index, fill_value=0
+        ).astype(float)
 
-        # get all date/show name tuples & remove show re-runs from same date
-        prog_dates = set(
-            [
-                (d.program_name, d.start_localtime.date())
-                for d in docs
-            ]
-        )
+    return counts['total'].reindex(index=date_index, fill_value=0).astype(
+        float
+    )
 
-        # count total number of shows on each date
-        # note we count the second entry of the tuples, which is just the
-        # date, excluding program name
-        shows_per_date = Counter(el[1] for el in prog_dates)
 
-        spd_series = pd.Series(
-            index=date_index,
-            data={'counts': np.zeros(n_dates)}
-        ).sort_index()
+# corpus id -> ((number of documents, latest datetime_added), show counts)
+SHOWS_PER_DATE_CACHE = {}
 
-        for date in shows_per_date:
-            spd_series.loc[date] = shows_per_date[date]
 
-        return spd_series
+def _corpus_documents_key(document_ids):
+    '''
+    Number of documents and the time the latest was added, which changes
+    whenever documents are added to or removed from a corpus.
+    '''
+    stats = list(IatvDocument._get_collection().aggregate([
+        {'$match': {'_id': {'$in': document_ids}}},
+        {'$group': {'_id': None, 'last_added': {'$max': '$datetime_added'}}}
+    ]))
+    last_added = stats[0]['last_added'] if stats else None
 
-    else:
-        # get all date/network/show name tuples
-        # & remove show re-runs from same date
-        prog_dates = set(
-            [
-                (d.program_name, d.network, d.start_localtime.date())
-                for d in docs
-            ]
-        )
+    return len(document_ids), last_added
+
+
+def _count_shows(document_ids, batch_size=DEFAULT_LOOKUP_BATCH_SIZE):
+    '''
+    Count distinct shows per date, overall and per network, projecting
+    only the fields needed from the corpus documents.
 
-        # count total number of shows on each date for each network
-        # note we count the second entry of the tuples, which is just the
-        # date, excluding program name
-        shows_per_network_per_date = Counter(el[1:] for el in prog_dates)
-
-        n_dates = len(date_index)
-        spd_frame = pd.DataFrame(
-            index=date_index,
-            data={
-                'MSNBCW': np.zeros(n_dates),
-                'CNNW': np.zeros(n_dates),
-                'FOXNEWSW': np.zeros(n_dates)
-            }
+    Returns:
+        (dict) 'total': pandas.Series and 'by_network': pandas.DataFrame of
+            counts indexed by date
+    '''
+    fields = ('program_name', 'network', 'start_localtime')
+
+    records = []
+    for i in range(0, len(document_ids), batch_size):
+        records.extend(
+            IatvDocument.objects(pk__in=document_ids[i:i + batch_size])
+            .only(*fields).as_pymongo()
         )
 
-        for tup in shows_per_network_per_date:
-            spd_frame.loc[tup[1]][tup[0]] = shows_per_network_per_date[tup]
+    shows = pd.DataFrame.from_records(records, columns=list(fields))
+    shows['date'] = pd.to_datetime(shows.start_localtime).dt.normalize()
+
+    # re-runs of a program on the same date are only counted once
+    total = shows.drop_duplicates(['program_name', 'date']).groupby(
+        'date'
+    ).size().rename('counts')
+
+    by_network = shows.drop_duplicates(
+        ['program_name', 'network', 'date']
+    ).groupby(['date', 'network']).size().unstack('network', fill_value=0)
 
-        return spd_frame
+    return dict(total=total, by_network=by_network)
 
 
-def daily_metaphor_counts(df, date_index, by=None):
+def daily_metaphor_counts(df, date_index, by=None, backend='pandas'):
     '''
     Given an Analyzer.df, creates a pivot table with date_index as index. Will
     group by the column names given in by. First deals with hourly data in
     order to build a common index with hourly data, which is the data's
     original format.
 
+    With backend='mongo' the counting is done by a MongoDB aggregation
+    instead and df is the name of the project; the returned table is the
+    same as the pandas backend's. df may also be a RollupCube, which is
+    summed instead of re-grouping every instance.
+
     Arguments:
-        df (pandas.DataFrame)
+        df (pandas.DataFrame): or RollupCube, or project name if backend is
+            'mongo'
         by (list(str))
         date_index (pandas.core.indexes.datetimes.DatetimeIndex): e.g.
             `pd.date_range('2016-09-01', '2016-11-30', freq='D')`
+        backend (str): 'pandas' or 'mongo'
     '''
     # get initial counts by localtime
     if by is None:
         by = []
 
-    counts = _count_by_start_localtime(df, column_list=by)
+    if isinstance(df, RollupCube):
+        counts = df.daily_counts(by)
+    elif backend == 'pandas':
+        counts = _count_by_start_localtime(df, column_list=by)
+        counts['start_localtime'] = counts.start_localtime.dt.date
+    elif backend == 'mongo':
+        counts = aggregate_daily_counts(df, by=by)
+    else:
+        raise ValueError("backend must be 'pandas' or 'mongo'")
 
-    groupby_spec = [counts.start_localtime.dt.date, *counts[by]]
+    # plain labels so both backends give the same column index
+    for column in by:
+        counts[column] = counts[column].astype(object)
 
-    counts_gb = counts.groupby(groupby_spec).sum().reset_index()
+    counts_gb = counts.groupby(
+        ['start_localtime', *by]
+    )[['counts']].sum().reset_index()
 
     ret = pd.pivot_table(counts_gb, index='start_localtime', values='counts',
                          columns=by, aggfunc='sum').fillna(0)
@@ -245,22 +383,22 @@ def daily_metaphor_counts(df, date_index, by=None):
     return ret
 
 
-def daily_frequency(df, date_index, iatv_corpus, by=None):
+def daily_frequency(df, date_index, iatv_corpus, by=None, backend='pandas'):
 
     if by is not None and 'network' in by:
         spd = shows_per_date(date_index, iatv_corpus, by_network=True)
-        daily = daily_metaphor_counts(df, date_index, by=by)
+        daily = daily_metaphor_counts(df, date_index, by=by, backend=backend)
         ret = daily.div(spd, axis='rows')
 
     elif by is None:
         spd = shows_per_date(date_index, iatv_corpus)
-        daily = daily_metaphor_counts(df, date_index, by=by)
+        daily = daily_metaphor_counts(df, date_index, by=by, backend=backend)
         ret = daily.div(spd, axis='rows')
         ret.columns = ['freq']
 
     else:
         spd = shows_per_date(date_index, iatv_corpus)
-        daily = daily_metaphor_counts(df, date_index, by=by)
+        daily = daily_metaphor_counts(df, date_index, by=by, backend=backend)
         ret = daily.div(spd, axis='rows')
 
     return ret
@@ -289,7 +427,7 @@ class SubjectObjectData:
     @classmethod
     def from_analyzer_df(cls, analyzer_df, subj=None, obj=None,
                          subj_contains=True, obj_contains=True,
-                         date_range=None):
+                         date_range=None, networks=None):
         '''
         Given an Analyzer instance's DataFrame, calculate the frequency of
         metaphorical violence with a given subject, object,
@@ -300,69 +438,111 @@ class SubjectObjectData:
             will be filled with by-network counts of the specified subj/obj
             configuration.
         '''
+        return cls.from_analyzer_df_pairs(
+            analyzer_df, [(subj, obj)], subj_contains=subj_contains,
+            obj_contains=obj_contains, date_range=date_range,
+            networks=networks
+        )[(subj, obj)]
 
-        if date_range is None:
-            pd.date_range('2016-09-01', '2016-11-30', freq='D')
-
-        pre = analyzer_df.fillna('')
-
-        def _match_checker(df, subj, obj, subj_contains, obj_contains):
-            '''
-            Returns list of booleans for selecting subject and object matches
-            '''
+    @classmethod
+    def from_analyzer_df_pairs(cls, analyzer_df, subj_obj_pairs,
+                               subj_contains=True, obj_contains=True,
+                               date_range=None, networks=None):
+        '''
+        Daily by-network counts for many subject/object configurations at
+        once. Subjects and objects are factorized once so patterns are only
+        matched against distinct values, and a single groupby pass counts
+        all pairs.
+
+        Arguments:
+            analyzer_df (pandas.DataFrame): exported project data
+            subj_obj_pairs (list): (subj, obj) tuples, either of which may be
+                None to match any subject or object, but not both
+            subj_contains, obj_contains (bool): match subj/obj as a regular
+                expression contained in the column instead of exactly
+            date_range (pandas.DatetimeIndex): daily index of the result;
+                defaults to Sep 1 - Nov 30, 2016
+            networks (list): columns of the result; defaults to
+                DEFAULT_NETWORKS
 
-            if subj is None and obj is None:
-                raise RuntimeError('subj and obj cannot both be None')
+        Returns:
+            (dict) (subj, obj) -> SubjectObjectData
+        '''
+        if date_range is None:
+            date_range = pd.date_range('2016-09-01', '2016-11-30', freq='D')
+        if networks is None:
+            networks = DEFAULT_NETWORKS
+
+        subj_obj_pairs = list(subj_obj_pairs)
+
+        subjects = _factorize_labels(analyzer_df.subjects)
+        objects = _factorize_labels(analyzer_df.objects)
+
+        masks = pd.DataFrame(
+            dict(
+                (idx, _match_mask(subjects, objects, subj, obj,
+                                  subj_contains, obj_contains))
+                for idx, (subj, obj) in enumerate(subj_obj_pairs)
+            ),
+            index=analyzer_df.index
+        )
 
-            if subj is not None:
-                if subj_contains:
-                    retSubj = list(df.subjects.str.contains(subj))
-                else:
-                    retSubj = list(df.subjects == subj)
+        summed = masks.groupby(
+            [analyzer_df.start_localtime.dt.normalize().rename('date'),
+             analyzer_df.network.astype(object).rename('network')]
+        ).sum()
 
-                if obj is None:
-                    ret = retSubj
+        network_index = pd.Index(networks, name='network')
+        ret = {}
+        for idx, (subj, obj) in enumerate(subj_obj_pairs):
+            counts_df = summed[idx].unstack('network').reindex(
+                index=date_range, columns=network_index, fill_value=0
+            ).fillna(0).astype(float)
+            ret[(subj, obj)] = cls(counts_df, subj, obj)
 
-            # TODO could probably combine these, but now not clear how
-            if obj is not None:
-                if obj_contains:
-                    retObj = list(df.objects.str.contains(obj))
-                else:
-                    retObj = list(df.objects == obj)
+        return ret
 
-                if subj is None:
-                    ret = retObj
-                else:
-                    ret = [rs and ro for rs, ro in zip(retSubj, retObj)]
+    def partition(self, partition_infos):
+        pass
 
-            return ret
 
-        chooser = _match_checker(pre, subj, obj, subj_contains, obj_contains)
+def _factorize_labels(column):
+    '''
+    (codes, uniques) of column with missing values as ''. Categorical
+    columns reuse their codes and categories.
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.codes.to_numpy().copy()
+        uniques = np.append(column.cat.categories.astype(str), '')
+        codes[codes == -1] = len(uniques) - 1
+        return codes, uniques
 
-        pre = pre[
-            chooser
-        ]
+    return pd.factorize(column.fillna('').astype(str))
 
-        # then do counts or frequencies as normal, since you have just
-        # subset the relevant rows.
-        counts_df = pd.DataFrame(
-            index=date_range, data=0.0,
-            columns=pd.Index(['MSNBCW', 'CNNW', 'FOXNEWSW'], name='network')
-        )
 
-        # there might be columns missing, so we have to insert into above zeros
-        to_insert_df = daily_metaphor_counts(pre, date_range, by=['network'])
+def _match_mask(subjects, objects, subj, obj, subj_contains, obj_contains):
+    '''
+    Boolean array selecting rows matching the subject and/or object. subjects
+    and objects are (codes, uniques) pairs from pandas.factorize, so each
+    pattern is only tested once per distinct value.
+    '''
+    if subj is None and obj is None:
+        raise RuntimeError('subj and obj cannot both be None')
 
-        for network in ['MSNBCW', 'CNNW', 'FOXNEWSW']:
-            if network in to_insert_df.columns:
-                for row in to_insert_df.itertuples():
-                    counts_df.loc[row.Index][network] = \
-                            row.__getattribute__(network)
+    mask = np.ones(len(subjects[0]), dtype=bool)
 
-        return cls(counts_df, subj, obj)
+    for (codes, uniques), pattern, contains in (
+                (subjects, subj, subj_contains), (objects, obj, obj_contains)
+            ):
+        if pattern is None:
+            continue
+        if contains:
+            hits = pd.Series(uniques).str.contains(pattern).to_numpy(bool)
+        else:
+            hits = np.asarray(uniques == pattern, dtype=bool)
+        mask &= hits[codes]
 
-    def partition(self, partition_infos):
-        pass
+    return mask
 
 
 def facet_word_count(analyzer_df, facet_word_index, by_network=True):
@@ -371,19 +551,30 @@ def facet_word_count(analyzer_df, facet_word_index, by_network=True):
     True, compute the usage of each word by network.
 
     Arguments:
-        analyzer_df (pandas.DataFrame): dataframe of the IatvCorpus annotations
+        analyzer_df (pandas.DataFrame): dataframe of the IatvCorpus
+            annotations, or a RollupCube of it
         by_network (bool): group each partition's word counts by network?
 
     Returns:
         (pandas.DataFrame) or (pandas.Series) of counts depending on by_network
     '''
     if by_network:
-        return analyzer_df.groupby(
-                ['network', 'facet_word']
-            ).size().unstack(level=0)[
+        return _group_sizes(
+                analyzer_df, ['network', 'facet_word']
+            ).unstack(level=0)[
                 ['MSNBCW', 'CNNW', 'FOXNEWSW']
             ].loc[facet_word_index].fillna(0.0)
     else:
-        return analyzer_df.groupby(
-                ['facet_word']
-            ).size().loc[facet_word_index].fillna(0.0)
+        return _group_sizes(
+                analyzer_df, ['facet_word']
+            ).loc[facet_word_index].fillna(0.0)
+
+
+def _group_sizes(df, columns):
+    '''
+    Number of rows per group of columns, from a frame or a RollupCube.
+    '''
+    if isinstance(df, RollupCube):
+        return df.counts(columns)
+
+    return df.groupby(columns).size()
@@ -0,0 +1,341 @@
+'''
+benchmark.py
+
+Timing comparisons for the export and analysis code paths on synthetic
+data, so no MongoDB connection is required. Run as
+
+    python -m metacorps.projects.common.benchmark [n_instances]
+'''
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+from .analysis import (
+    SubjectObjectData, daily_metaphor_counts, normalize_data_frame
+)
+from .export_project import (
+    IATV_DOCUMENT_COLUMNS, INSTANCE_COLUMNS, _build_dataframe, _format_row
+)
+from .rollup import RollupCube
+
+
+NETWORKS = ['MSNBCW', 'CNNW', 'FOXNEWSW']
+
+
+class _SyntheticInstance(dict):
+    '''
+    Stand-in for app.models.Instance supporting both item and attribute
+    access, which is all the exporter needs.
+    '''
+    __getattr__ = dict.__getitem__
+
+
+def synthetic_project(n_instances, n_docs=None, seed=42):
+    '''
+    Build synthetic (facet_word, instance) tuples and the matching
+    IatvDocument lookup.
+
+    Arguments:
+        n_instances (int): number of instances to generate
+        n_docs (int): number of distinct source documents; defaults to a
+            tenth of n_instances
+        seed (int): random seed
+
+    Returns:
+        (list, dict) keyed instances and IatvDocument lookup
+    '''
+    rng = np.random.RandomState(seed)
+
+    if n_docs is None:
+        n_docs = max(1, n_instances // 10)
+
+    start = datetime(2016, 9, 1)
+    iatv_docs = {}
+    for doc_id in range(n_docs):
+        network = NETWORKS[doc_id % len(NETWORKS)]
+        hours = int(rng.randint(0, 24 * 90))
+        start_localtime = start + timedelta(hours=hours)
+        program_name = 'Program {}'.format(doc_id % 50)
+        iatv_docs[doc_id] = {
+            '_id': doc_id,
+            'start_localtime': start_localtime,
+            'start_time': start_localtime,
+            'stop_time': start_localtime + timedelta(hours=1),
+            'runtime_seconds': 3600.0,
+            'network': network,
+            'program_name': program_name,
+            'iatv_id': '{}_{}_{}'.format(
+                network, start_localtime.strftime('%Y%m%d_%H%M%S'),
+                program_name.replace(' ', '_')
+            ),
+        }
+
+    facet_words = ['attack', 'hit', 'beat', 'slap', 'strangle']
+    keyed_instances = []
+    for idx in range(n_instances):
+        instance = _SyntheticInstance(
+            source_id=int(rng.randint(0, n_docs)),
+            figurative=bool(rng.randint(0, 2)),
+            include=True,
+            spoken_by='speaker {}'.format(idx % 100),
+            subjects='subject {}'.format(idx % 30),
+            objects='object {}'.format(idx % 30),
+            conceptual_metaphor='metaphor {}'.format(idx % 10),
+            active_passive='active',
+            text='snippet text {}'.format(idx),
+            tense='present',
+            repeat=False,
+            repeat_index=None,
+        )
+        keyed_instances.append(
+            (facet_words[idx % len(facet_words)], instance)
+        )
+
+    return keyed_instances, iatv_docs
+
+
+def _rowwise_dataframe(keyed_instances, iatv_docs, column_names):
+    '''
+    The original export path, growing the frame with one .loc write per row.
+    '''
+    df = pd.DataFrame(columns=column_names)
+
+    for idx, inst in enumerate(keyed_instances):
+        df.loc[idx] = _format_row(inst, iatv_docs)
+
+    return df
+
+
+def _timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    ret = func(*args, **kwargs)
+    return ret, time.perf_counter() - t0
+
+
+def bench_export_dataframe(n_instances=100000, rowwise_limit=2000):
+    '''
+    Compare the row-by-row and columnar DataFrame export paths. The
+    row-by-row path grows superlinearly, so it is timed on at most
+    rowwise_limit instances and scaled linearly, which understates its cost.
+    '''
+    column_names = IATV_DOCUMENT_COLUMNS + ['facet_word'] + INSTANCE_COLUMNS
+    keyed_instances, iatv_docs = synthetic_project(n_instances)
+
+    n_rowwise = min(n_instances, rowwise_limit)
+    _, t_rowwise = _timed(
+        _rowwise_dataframe, keyed_instances[:n_rowwise], iatv_docs,
+        column_names
+    )
+    t_rowwise *= n_instances / n_rowwise
+
+    _, t_columnar = _timed(
+        _build_dataframe, keyed_instances, iatv_docs, column_names
+    )
+
+    print('export_dataframe, {} instances'.format(n_instances))
+    print('    row-by-row: {}{:.2f}s'.format(
+        '>= ' if n_rowwise < n_instances else '', t_rowwise
+    ))
+    print('    columnar:   {:.2f}s ({:.0f}x)'.format(
+        t_columnar, t_rowwise / t_columnar
+    ))
+
+
+PEOPLE = ['donald trump', 'hillary clinton', 'barack obama', 'the epa',
+          'republicans', 'democrats', 'bernie sanders', 'mike pence',
+          'tim kaine', 'the media']
+
+
+def synthetic_analysis_frame(n_rows=1000000, seed=42):
+    '''
+    Frame shaped like the output of get_project_data_frame, without text.
+    '''
+    rng = np.random.RandomState(seed)
+
+    start = np.datetime64('2016-09-01T00:00')
+    minutes = rng.randint(0, 60 * 24 * 91, n_rows)
+    subjects = np.array(PEOPLE + [''], dtype=object)
+    objects = np.array(PEOPLE + ['the economy', 'jobs', ''], dtype=object)
+
+    return pd.DataFrame({
+        'start_localtime': start + minutes.astype('timedelta64[m]'),
+        'network': np.array(NETWORKS, dtype=object)[
+            rng.randint(0, len(NETWORKS), n_rows)
+        ],
+        'program_name': np.array(
+            ['Program {}'.format(i) for i in range(50)], dtype=object
+        )[rng.randint(0, 50, n_rows)],
+        'facet_word': np.array(
+            ['attack', 'hit', 'beat', 'slap', 'strangle'], dtype=object
+        )[rng.randint(0, 5, n_rows)],
+        'subjects': subjects[rng.randint(0, len(subjects), n_rows)],
+        'objects': objects[rng.randint(0, len(objects), n_rows)],
+    })
+
+
+def _loop_subject_object_counts(analyzer_df, subj, obj, date_range):
+    '''
+    The original SubjectObjectData.from_analyzer_df: list masks and a
+    per-network, per-row fill. Its chained .loc writes, which do not write
+    through under copy-on-write, are made single .loc writes so that it
+    computes the same counts as the vectorized version.
+    '''
+    pre = analyzer_df.fillna('')
+
+    ret_subj = list(pre.subjects.str.contains(subj))
+    ret_obj = list(pre.objects.str.contains(obj))
+    pre = pre[[rs and ro for rs, ro in zip(ret_subj, ret_obj)]]
+
+    counts_df = pd.DataFrame(
+        index=date_range, data=0.0,
+        columns=pd.Index(NETWORKS, name='network')
+    )
+    # daily_metaphor_counts(pre, date_range, by=['network']), without the
+    # object sums newer pandas refuses
+    to_insert_df = pd.pivot_table(
+        pre.assign(counts=1.0, date=pre.start_localtime.dt.date),
+        index='date', columns='network', values='counts', aggfunc='sum'
+    ).fillna(0)
+    for network in NETWORKS:
+        if network in to_insert_df.columns:
+            for row in to_insert_df.itertuples():
+                date = pd.Timestamp(row.Index)
+                if date in counts_df.index:
+                    counts_df.loc[date, network] = getattr(row, network)
+
+    return counts_df
+
+
+def bench_subject_object(n_rows=1000000, n_pairs=10):
+    '''
+    Compare per-pair looped counting with the vectorized single and
+    multi-pair SubjectObjectData constructors.
+    '''
+    df = synthetic_analysis_frame(n_rows)
+    date_range = pd.date_range('2016-09-01', '2016-11-30', freq='D')
+    pairs = [(PEOPLE[i % len(PEOPLE)], PEOPLE[(i + 1) % len(PEOPLE)])
+             for i in range(n_pairs)]
+
+    looped, t_loop = _timed(lambda: [
+        _loop_subject_object_counts(df, subj, obj, date_range)
+        for subj, obj in pairs
+    ])
+    vector, t_vector = _timed(lambda: [
+        SubjectObjectData.from_analyzer_df(df, subj, obj,
+                                           date_range=date_range)
+        for subj, obj in pairs
+    ])
+    multi, t_multi = _timed(
+        SubjectObjectData.from_analyzer_df_pairs, df, pairs,
+        date_range=date_range
+    )
+
+    for pair, expected, single in zip(pairs, looped, vector):
+        for counts in (single.data_frame, multi[pair].data_frame):
+            pd.testing.assert_frame_equal(
+                counts, expected, check_like=True, check_freq=False
+            )
+
+    print('SubjectObjectData, {} rows, {} subject/object pairs'.format(
+        n_rows, n_pairs
+    ))
+    print('    looped, per pair:     {:.2f}s'.format(t_loop))
+    print('    vectorized, per pair: {:.2f}s ({:.1f}x)'.format(
+        t_vector, t_loop / t_vector
+    ))
+    print('    vectorized, one call: {:.2f}s ({:.1f}x)'.format(
+        t_multi, t_loop / t_multi
+    ))
+
+
+def bench_rollup(n_rows=1000000):
+    '''
+    Time several daily_metaphor_counts groupings from the raw frame and from
+    a RollupCube, including the one-off cost of building the cube.
+    '''
+    df = synthetic_analysis_frame(n_rows)
+    date_range = pd.date_range('2016-09-01', '2016-11-30', freq='D')
+    bys = [None, ['network'], ['facet_word'], ['network', 'facet_word'],
+           ['program_name']]
+
+    _, t_frame = _timed(lambda: [
+        daily_metaphor_counts(df, date_range, by=by) for by in bys
+    ])
+    cube, t_build = _timed(RollupCube.from_frame, df)
+    _, t_cube = _timed(lambda: [
+        daily_metaphor_counts(cube, date_range, by=by) for by in bys
+    ])
+
+    print('daily_metaphor_counts, {} rows, {} groupings, {} cube cells'.format(
+        n_rows, len(bys), len(cube.table)
+    ))
+    print('    raw frame:     {:.2f}s'.format(t_frame))
+    print('    build cube:    {:.2f}s'.format(t_build))
+    print('    from cube:     {:.2f}s ({:.1f}x)'.format(
+        t_cube, t_frame / t_cube
+    ))
+
+
+def bench_normalize(n_rows=1000000, seed=42):
+    '''
+    Memory use and grouping/matching speed of the object-string analysis
+    frame against the normalized, categorical one.
+    '''
+    rng = np.random.RandomState(seed)
+
+    df = synthetic_analysis_frame(n_rows, seed=seed)
+    # the casing and stray whitespace of hand-entered annotations
+    variants = np.array([str.upper, str.title, lambda s: ' ' + s + ' ',
+                         lambda s: s], dtype=object)
+    for column in ('subjects', 'objects'):
+        df[column] = [
+            f(value) for f, value in
+            zip(variants[rng.randint(0, len(variants), n_rows)], df[column])
+        ]
+    df['tense'] = np.array(['past', 'present', 'future'], dtype=object)[
+        rng.randint(0, 3, n_rows)
+    ]
+    df = df.astype(dict((c, object) for c in df.columns
+                        if c != 'start_localtime'))
+
+    def per_row(df):
+        subjects = df.subjects.map(lambda s: s.strip().lower())
+        objects = df.objects.map(lambda s: s.strip().lower())
+        return df.assign(subjects=subjects, objects=objects)
+
+    def work(df):
+        df.groupby(['network', 'subjects']).size()
+        df.groupby(['facet_word', 'objects', 'tense']).size()
+        df.subjects.str.contains('trump').sum()
+        df.objects.str.contains('clinton').sum()
+
+    raw, t_map = _timed(per_row, df)
+    normalized, t_normalize = _timed(normalize_data_frame, df)
+    _, t_raw = _timed(work, raw)
+    _, t_normalized = _timed(work, normalized)
+
+    mb_raw = raw.memory_usage(deep=True).sum() / 1024 ** 2
+    mb_normalized = normalized.memory_usage(deep=True).sum() / 1024 ** 2
+
+    print('analysis frame normalization, {} rows'.format(n_rows))
+    print('    memory:  {:.0f} MB objects, {:.0f} MB categorical '
+          '({:.1f}x)'.format(mb_raw, mb_normalized, mb_raw / mb_normalized))
+    print('    normalize: {:.2f}s per-row map of 2 columns, {:.2f}s all '
+          'columns to categorical'.format(
+        t_map, t_normalize
+    ))
+    print('    groupby/contains: {:.2f}s objects, {:.2f}s categorical '
+          '({:.1f}x)'.format(t_raw, t_normalized, t_raw / t_normalized))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    bench_export_dataframe(n)
+    bench_subject_object()
+    bench_rollup()
+    bench_normalize()
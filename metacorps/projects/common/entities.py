@@ -0,0 +1,91 @@
+'''
+entities.py
+
+Map free-text subject and object annotations to canonical entity names.
+Each entity has a list of alias patterns, compiled into one regular
+expression per entity. Each distinct annotation is matched once and assigned
+the first entity, in the order given, that it mentions.
+'''
+import re
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_ENTITY_ALIASES = OrderedDict([
+    ('donald trump', [r'donald trump']),
+    ('hillary clinton', [r'hillary clinton']),
+])
+
+# annotations naming several parties ('x/y') or a campaign are not
+# attributed to any one entity
+DEFAULT_ENTITY_EXCLUDE = [r'/', r'campaign']
+
+
+class EntityAliases:
+
+    def __init__(self, aliases=DEFAULT_ENTITY_ALIASES,
+                 exclude=DEFAULT_ENTITY_EXCLUDE):
+        '''
+        Arguments:
+            aliases (dict): canonical entity name -> list of regular
+                expressions matching mentions of it in lowercased
+                annotations. Entities earlier in the dict win when an
+                annotation mentions more than one, wherever they appear in it
+            exclude (list): regular expressions; annotations matching any of
+                them get no entity
+        '''
+        self.entities = list(aliases)
+        if not self.entities:
+            raise ValueError('aliases must name at least one entity')
+
+        # tried in order, so precedence follows aliases rather than where
+        # in the annotation each entity is mentioned
+        self.patterns = [
+            re.compile('|'.join('(?:{})'.format(p) for p in patterns))
+            for patterns in aliases.values()
+        ]
+        self.exclude = re.compile('|'.join(exclude)) if exclude else None
+
+    def canonical(self, annotation):
+        '''
+        Canonical entity mentioned in annotation, or None.
+        '''
+        if not isinstance(annotation, str):
+            return None
+        if self.exclude is not None and self.exclude.search(annotation):
+            return None
+
+        for entity, pattern in zip(self.entities, self.patterns):
+            if pattern.search(annotation):
+                return entity
+
+        return None
+
+    def canonicalize(self, column):
+        '''
+        Categorical Series of the canonical entity of each value of column,
+        missing where none matches. Each distinct value is matched once.
+        '''
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy()
+            uniques = column.cat.categories
+        else:
+            codes, uniques = pd.factorize(column)
+
+        categories = pd.Index(self.entities)
+        entity_codes = categories.get_indexer(
+            [self.canonical(value) for value in uniques]
+        )
+
+        # missing values keep code -1, also when column has no values
+        present = codes >= 0
+        new_codes = np.full(len(codes), -1, dtype=np.int64)
+        new_codes[present] = entity_codes[codes[present]]
+
+        return pd.Series(
+            pd.Categorical.from_codes(new_codes, categories=categories),
+            index=column.index, name=column.name
+        )
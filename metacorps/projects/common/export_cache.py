@@ -0,0 +1,168 @@
+'''
+export_cache.py
+
+Local on-disk cache of exported project DataFrames so that repeated
+analysis runs do not have to re-export the project from MongoDB.
+
+Exports are stored as Feather files keyed by the project id, the project's
+last_modified time, and its facet ids, so any annotation edit or new facet
+results in a cache miss. Hits are memory-mapped back in. The cache directory
+is trimmed to a maximum size by evicting the least recently used exports.
+
+Requires pyarrow.
+'''
+import hashlib
+import os
+import tempfile
+
+from .export_project import ProjectExporter
+
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'METACORPS_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'metacorps', 'exports')
+)
+
+# 2 GB
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+CACHE_EXTENSION = '.feather'
+
+
+class ExportCache:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        '''
+        Arguments:
+            cache_dir (str): directory where exports are stored; created if
+                it does not exist
+            max_bytes (int): total size of cached exports above which least
+                recently used exports are deleted
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_dataframe(self, project_name, included_only=True, refresh=False,
+                      columns=None):
+        '''
+        Exported DataFrame for project_name, read from the cache if the
+        project has not changed since it was cached and re-exported and
+        stored otherwise.
+
+        Arguments:
+            project_name (str): name of the Project to export
+            included_only (bool): passed on to export_dataframe
+            refresh (bool): ignore any cached export and rebuild it
+            columns (list): read only these columns; the others, e.g. the
+                instance text, are never loaded from the cached file
+
+        Returns:
+            (pandas.DataFrame) exported project
+        '''
+        exporter = ProjectExporter(project_name)
+        key = export_key(exporter.project, included_only=included_only)
+
+        if not refresh:
+            df = self.load(key, columns=columns)
+            if df is not None:
+                return df
+
+        df = exporter.export_dataframe(included_only=included_only)
+        self.store(key, df)
+
+        if columns is not None:
+            df = df[list(columns)]
+
+        return df
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def load(self, key, columns=None):
+        '''
+        Memory-map a cached export, or only the given columns of it, back
+        in. Returns None on a miss.
+        '''
+        import pyarrow.feather as feather
+
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        # mark as recently used for eviction
+        os.utime(path)
+
+        return feather.read_table(
+            path, columns=columns, memory_map=True
+        ).to_pandas()
+
+    def store(self, key, df):
+        '''
+        Atomically write df to the cache under key, then evict old exports.
+        '''
+        import pyarrow.feather as feather
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            # uncompressed so that reads can be memory-mapped
+            feather.write_feather(
+                df.reset_index(drop=True), tmp_path, compression='uncompressed'
+            )
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        '''
+        Delete least recently used exports until the cache fits in
+        max_bytes. The export stored under keep is never deleted.
+        '''
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(CACHE_EXTENSION):
+                stat = os.stat(os.path.join(self.cache_dir, fname))
+                entries.append((stat.st_mtime, stat.st_size, fname))
+
+        total = sum(size for _, size, _ in entries)
+        keep_fname = None if keep is None else keep + CACHE_EXTENSION
+
+        for _, size, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if fname == keep_fname:
+                continue
+            os.remove(os.path.join(self.cache_dir, fname))
+            total -= size
+
+    def clear(self):
+
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(CACHE_EXTENSION):
+                os.remove(os.path.join(self.cache_dir, fname))
+
+
+def export_key(project, included_only=True):
+    '''
+    Cache key for an export of project, which changes whenever the project's
+    last_modified time or set of facets changes.
+    '''
+    facet_ids = sorted(str(facet_id)
+                       for facet_id in project.get_facet_ids(project.pk))
+
+    key_src = '|'.join([
+        str(project.pk),
+        project.last_modified.isoformat() if project.last_modified else '',
+        ','.join(facet_ids),
+        'included' if included_only else 'all',
+    ])
+
+    return '{}-{}'.format(
+        project.pk, hashlib.sha1(key_src.encode('utf-8')).hexdigest()
+    )
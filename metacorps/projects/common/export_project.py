@@ -2,7 +2,8 @@
 '''
 export_project_csv.py
 
-Convert `project` collections in MongoDB to a CSV for downstream analysis.
+Convert `project` collections in MongoDB to a DataFrame or to CSV, Parquet or
+newline-delimited JSON files for downstream analysis.
 
 By default includes all the columns as listed in the global DEFAULT_COLUMNS
 variable.
@@ -10,10 +11,10 @@ variable.
 Author: Matthew Turner
 Date: May 29, 2019
 '''
-import csv
+import os
 import pandas as pd
 
-from metacorps.app.models import Project, IatvDocument
+from metacorps.app.models import Project, Facet, IatvDocument
 
 
 IATV_DOCUMENT_COLUMNS = [
@@ -40,74 +41,376 @@ INSTANCE_COLUMNS = [
     'repeat_index'
 ]
 
+EXPORT_COLUMNS = IATV_DOCUMENT_COLUMNS + ['facet_word'] + INSTANCE_COLUMNS
+
+DATETIME_COLUMNS = ['start_localtime', 'start_time', 'stop_time']
+BOOLEAN_COLUMNS = ['figurative', 'include', 'repeat']
+CATEGORY_COLUMNS = ['network', 'facet_word', 'program_name']
+
+INTEGER_COLUMNS = ['repeat_index']
+FLOAT_COLUMNS = ['runtime_seconds']
+
+# number of source_ids resolved per `$in` query when looking up IatvDocuments
+DEFAULT_LOOKUP_BATCH_SIZE = 1000
+# number of rows held in memory at a time by the streaming exports
+DEFAULT_CHUNK_SIZE = 10000
+
 
 class ProjectExporter:
 
-    def __init__(self, project_name):
+    def __init__(self, project_name,
+                 lookup_batch_size=DEFAULT_LOOKUP_BATCH_SIZE):
         """
         Initialize a new project exporter
+
+        Arguments:
+            project_name (str): name of the Project to export
+            lookup_batch_size (int): number of IatvDocument ids to resolve
+                per query when building the source document lookup
         """
 
         self.project = Project.objects.get(name=project_name)
+        self.lookup_batch_size = lookup_batch_size
 
-        self.keyed_instances = (
+        self.column_names = list(EXPORT_COLUMNS)
+
+    @property
+    def keyed_instances(self):
+        '''
+        (facet_word, Instance) tuples over the whole project. A fresh
+        generator is returned on every access, and facets are loaded one at a
+        time, so the source can be iterated repeatedly without holding the
+        whole project in memory.
+        '''
+        return (
             (facet.word, instance)
-            for facet in self.project.facets
+            for facet in self._iter_facets()
             for instance in facet.instances
-            # if instance.include
         )
-        self.column_names =\
-            IATV_DOCUMENT_COLUMNS + \
-            ['facet_word'] + \
-            INSTANCE_COLUMNS
-
-    # def _keyed_instances(self):
-
-    #     return self.keyed_instances
 
-    def export_csv(self, export_path, included_only=True):
+    def _keyed_instances(self, included_only=True):
 
         if included_only:
-            _keyed_instances = (
+            return (
                 key_inst for key_inst in self.keyed_instances
                 if key_inst[1].include
             )
-        else:
-            _keyed_instances = self.keyed_instances
 
-        with open(export_path, 'w') as f:
+        return self.keyed_instances
 
-            csvwriter = csv.writer(f)
+    def _iter_facets(self):
 
-            csvwriter.writerow(self.colunm_names)
+        for facet_id in Project.get_facet_ids(self.project.pk):
+            yield Facet.objects.get(pk=facet_id)
 
-            for inst in _keyed_instances:
-                csvwriter.writerow(_format_row(inst))
+    def iatv_docs(self, keyed_instances=None):
+        '''
+        Lookup of every IatvDocument referenced by keyed_instances, by
+        default all of the project's instances, keyed by document id. Built
+        with batched queries on every call, so documents of instances added
+        since an earlier export are included.
+        '''
+        if keyed_instances is None:
+            keyed_instances = self.keyed_instances
 
-    def export_dataframe(self, included_only=True):
+        return _lookup_iatv_docs(
+            set(instance.source_id for _, instance in keyed_instances),
+            batch_size=self.lookup_batch_size
+        )
 
-        df = pd.DataFrame(columns=self.column_names)
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE, included_only=True):
+        '''
+        Stream the export as DataFrames of at most chunk_size rows. Source
+        documents are looked up per chunk so memory use is bounded by
+        chunk_size rather than by the size of the project.
 
-        if included_only:
-            _keyed_instances = (
-                key_inst for key_inst in self.keyed_instances
-                if key_inst[1].include
+        Arguments:
+            chunk_size (int): maximum number of rows per yielded DataFrame
+            included_only (bool): skip instances not marked include
+
+        Yields:
+            (pandas.DataFrame) chunk with the same columns and dtypes as
+                export_dataframe
+        '''
+        chunk = []
+        n_chunks = 0
+        for key_inst in self._keyed_instances(included_only):
+            chunk.append(key_inst)
+            if len(chunk) == chunk_size:
+                yield self._chunk_dataframe(chunk)
+                n_chunks += 1
+                chunk = []
+
+        # always yield at least one, possibly empty, chunk so writers emit
+        # headers and schemas for empty projects
+        if chunk or n_chunks == 0:
+            yield self._chunk_dataframe(chunk)
+
+    def _chunk_dataframe(self, keyed_instances):
+
+        return _build_dataframe(
+            keyed_instances, self.iatv_docs(keyed_instances),
+            self.column_names
+        )
+
+    def export_chunked(self, export_path, export_format=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE, included_only=True):
+        '''
+        Write the export to disk chunk by chunk with constant memory.
+
+        Arguments:
+            export_path (str): output file path
+            export_format (str): one of 'csv', 'parquet' or 'ndjson'; if
+                None it is inferred from the extension of export_path
+            chunk_size (int): rows held in memory at a time; for parquet this
+                is also the row group size
+            included_only (bool): skip instances not marked include
+        '''
+        if export_format is None:
+            export_format = os.path.splitext(export_path)[1].lstrip('.')
+            export_format = {'jsonl': 'ndjson'}.get(
+                export_format, export_format
             )
-        else:
-            _keyed_instances = self.keyed_instances
 
-        for idx, inst in enumerate(_keyed_instances):
-            df.loc[idx] = _format_row(inst)
+        try:
+            writer = CHUNK_WRITERS[export_format]
+        except KeyError:
+            raise ValueError(
+                'export_format must be one of {}, not {!r}'.format(
+                    sorted(CHUNK_WRITERS), export_format
+                )
+            )
+
+        writer(
+            self.iter_chunks(chunk_size, included_only=included_only),
+            export_path
+        )
+
+    def export_csv(self, export_path, included_only=True,
+                   chunk_size=DEFAULT_CHUNK_SIZE):
+
+        self.export_chunked(export_path, 'csv', chunk_size=chunk_size,
+                            included_only=included_only)
+
+    def export_parquet(self, export_path, included_only=True,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+
+        self.export_chunked(export_path, 'parquet', chunk_size=chunk_size,
+                            included_only=included_only)
+
+    def export_ndjson(self, export_path, included_only=True,
+                      chunk_size=DEFAULT_CHUNK_SIZE):
+
+        self.export_chunked(export_path, 'ndjson', chunk_size=chunk_size,
+                            included_only=included_only)
+
+    def export_dataframe(self, included_only=True):
+
+        # one pass over the facets serves both the rows and the lookup
+        keyed_instances = list(self._keyed_instances(included_only))
+
+        return _build_dataframe(
+            keyed_instances, self.iatv_docs(keyed_instances),
+            self.column_names
+        )
+
+    def export_incremental(self, since, base, included_only=True):
+        '''
+        Update a previous export by re-reading only the facets modified
+        after since. Rows of changed facets are replaced wholesale, rows of
+        facets removed from the project are dropped, and rows of all other
+        facets are kept from base.
+
+        Arguments:
+            since (datetime.datetime): time the base export was started
+            base (pandas.DataFrame or str): previous export, or path to a
+                previous parquet export, which is overwritten with the
+                updated export
+            included_only (bool): must match the setting used for base
+
+        Returns:
+            (pandas.DataFrame) export equivalent to a fresh export_dataframe
+        '''
+        base_path = None
+        if isinstance(base, str):
+            base_path = base
+            base = pd.read_parquet(base_path)
+
+        facet_ids = Project.get_facet_ids(self.project.pk)
+        words_by_id = dict(
+            (facet['_id'], facet['word'])
+            for facet in Facet.objects(
+                pk__in=facet_ids
+            ).only('word').as_pymongo()
+        )
+        facet_order = dict(
+            (words_by_id[facet_id], idx)
+            for idx, facet_id in enumerate(facet_ids)
+            if facet_id in words_by_id
+        )
+
+        changed_facets = list(
+            Facet.objects(pk__in=facet_ids, last_modified__gt=since)
+        )
+        changed_words = set(facet.word for facet in changed_facets)
+
+        changed_instances = [
+            (facet.word, instance)
+            for facet in changed_facets
+            for instance in facet.instances
+            if instance.include or not included_only
+        ]
+        changed_df = _build_dataframe(
+            changed_instances,
+            _lookup_iatv_docs(
+                set(inst.source_id for _, inst in changed_instances),
+                batch_size=self.lookup_batch_size
+            ),
+            self.column_names
+        )
+
+        keep_words = set(facet_order) - changed_words
+        unchanged_df = base[base.facet_word.astype(object).isin(keep_words)]
+
+        df = pd.concat([unchanged_df, changed_df], ignore_index=True)
+        df = df.sort_values(
+            'facet_word', kind='stable',
+            key=lambda col: col.astype(object).map(facet_order)
+        ).reset_index(drop=True)
+        df = _set_column_dtypes(df)
+
+        if base_path is not None:
+            _write_parquet_chunks([df], base_path)
 
         return df
 
 
-def _lookup_iatv_doc(instance):
-    return IatvDocument.objects.get(pk=instance.source_id)
+def _lookup_iatv_docs(source_ids, batch_size=DEFAULT_LOOKUP_BATCH_SIZE):
+    '''
+    Resolve many IatvDocuments with one `$in` query per batch of ids instead
+    of one query per instance. Only IATV_DOCUMENT_COLUMNS are projected so
+    the large document_data and raw_srt fields are never transferred.
 
+    Arguments:
+        source_ids (iterable): IatvDocument ids to look up
+        batch_size (int): maximum number of ids per query
 
-def _format_row(instance):
-    iatv_doc = _lookup_iatv_doc(instance[1])
+    Returns:
+        (dict) mapping of document id to raw document dictionary
+    '''
+    source_ids = list(source_ids)
+
+    lookup = {}
+    for start in range(0, len(source_ids), batch_size):
+        batch = source_ids[start:start + batch_size]
+        docs = IatvDocument.objects(
+            pk__in=batch
+        ).only(*IATV_DOCUMENT_COLUMNS).as_pymongo()
+
+        for doc in docs:
+            lookup[doc['_id']] = doc
+
+    return lookup
+
+
+def _format_row(instance, iatv_docs):
+    iatv_doc = iatv_docs[instance[1].source_id]
     facet_word = instance[0]
-    return [iatv_doc[field] for field in IATV_DOCUMENT_COLUMNS] +\
+    return [iatv_doc.get(field) for field in IATV_DOCUMENT_COLUMNS] +\
         [facet_word] + [instance[1][field] for field in INSTANCE_COLUMNS]
+
+
+def _build_dataframe(keyed_instances, iatv_docs, column_names):
+    '''
+    Build the export DataFrame in one shot from formatted rows rather than
+    growing it row by row, then set column dtypes.
+
+    Arguments:
+        keyed_instances (iterable): (facet_word, Instance) tuples
+        iatv_docs (dict): IatvDocument lookup as from _lookup_iatv_docs
+        column_names (list): names of the exported columns
+
+    Returns:
+        (pandas.DataFrame) one row per instance
+    '''
+    rows = [_format_row(inst, iatv_docs) for inst in keyed_instances]
+
+    df = pd.DataFrame.from_records(rows, columns=column_names)
+
+    return _set_column_dtypes(df)
+
+
+def _set_column_dtypes(df):
+    '''
+    Convert datetime columns to datetime64, flags to bool, and the
+    low-cardinality label columns to category. Dtypes do not depend on the
+    data, so every chunk of a streaming export has the same schema.
+    '''
+    for col in DATETIME_COLUMNS:
+        if col in df:
+            df[col] = pd.to_datetime(df[col]).astype('datetime64[ns]')
+
+    for col in BOOLEAN_COLUMNS:
+        if col in df:
+            df[col] = df[col].fillna(False).astype(bool)
+
+    for col in INTEGER_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col]).astype('Int64')
+
+    for col in FLOAT_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col]).astype('float64')
+
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+
+    return df
+
+
+def _write_csv_chunks(chunks, export_path):
+
+    with open(export_path, 'w') as f:
+        for idx, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=(idx == 0), index=False)
+
+
+def _write_ndjson_chunks(chunks, export_path):
+
+    with open(export_path, 'w') as f:
+        for chunk in chunks:
+            # an empty project yields one empty chunk; write nothing for it
+            if chunk.empty:
+                continue
+            lines = chunk.to_json(orient='records', lines=True,
+                                  date_format='iso')
+            f.write(lines if lines.endswith('\n') else lines + '\n')
+
+
+def _write_parquet_chunks(chunks, export_path):
+    '''
+    Write each chunk as its own parquet row group. Requires pyarrow.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(export_path, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+CHUNK_WRITERS = {
+    'csv': _write_csv_chunks,
+    'ndjson': _write_ndjson_chunks,
+    'parquet': _write_parquet_chunks,
+}
@@ -0,0 +1,127 @@
+'''
+rollup.py
+
+Materialized daily rollup of a project's instances. One pass over the
+exported frame counts instances per date, network, facet word and program
+name; analysis functions given a RollupCube in place of the frame then
+answer by summing over the dimensions they do not group by, instead of
+re-grouping every instance.
+
+The cube is held as a Series of counts indexed by the non-empty cells only,
+and is saved as a dictionary-encoded Parquet table.
+'''
+import pandas as pd
+
+
+DEFAULT_DIMENSIONS = ['date', 'network', 'facet_word', 'program_name']
+
+
+class RollupCube:
+
+    def __init__(self, table):
+        '''
+        Arguments:
+            table (pandas.Series): counts indexed by a MultiIndex with one
+                level per dimension; use from_frame or read_parquet to build
+        '''
+        self.table = table
+
+    @property
+    def dimensions(self):
+        return list(self.table.index.names)
+
+    @classmethod
+    def from_frame(cls, df, dimensions=DEFAULT_DIMENSIONS):
+        '''
+        Build the cube from an exported project frame, as returned by
+        get_project_data_frame.
+
+        Arguments:
+            df (pandas.DataFrame): one row per instance
+            dimensions (list): 'date', the day of start_localtime, and any
+                other columns of df to keep as dimensions
+        '''
+        return cls(_rollup(df, list(dimensions)))
+
+    def append(self, df):
+        '''
+        Add the counts of newly exported instances to the cube in place.
+
+        Arguments:
+            df (pandas.DataFrame): new rows only, with the same columns as
+                the frame the cube was built from
+        '''
+        new = _rollup(df, self.dimensions)
+        self.table = self.table.add(new, fill_value=0).astype('int64')
+
+        return self
+
+    def counts(self, by=None):
+        '''
+        Counts summed over every dimension not in by.
+
+        Arguments:
+            by (list): dimensions to keep, in order
+
+        Returns:
+            (pandas.Series) counts indexed by the by dimensions, or the total
+                count if by is empty
+        '''
+        if not by:
+            return int(self.table.sum())
+
+        missing = [d for d in by if d not in self.dimensions]
+        if missing:
+            raise ValueError('dimensions {} are not in the cube {}'.format(
+                missing, self.dimensions
+            ))
+
+        return self.table.groupby(level=list(by), sort=True).sum()
+
+    def daily_counts(self, by=None):
+        '''
+        Long table of counts per day and per value of the dimensions in by,
+        as used by analysis.daily_metaphor_counts.
+        '''
+        ret = self.counts(['date'] + list(by or [])).rename('counts')
+        ret = ret.reset_index().rename(columns={'date': 'start_localtime'})
+        ret['start_localtime'] = ret.start_localtime.dt.date
+
+        return ret
+
+    def to_parquet(self, path):
+
+        table = self.table.rename('counts').reset_index()
+        for dimension in self.dimensions:
+            if dimension != 'date':
+                table[dimension] = table[dimension].astype('category')
+        table['counts'] = table['counts'].astype('int32')
+
+        table.to_parquet(path, index=False)
+
+    @classmethod
+    def read_parquet(cls, path):
+
+        table = pd.read_parquet(path)
+        dimensions = [c for c in table.columns if c != 'counts']
+        for dimension in dimensions:
+            if dimension != 'date':
+                table[dimension] = table[dimension].astype(object)
+
+        return cls(
+            table.set_index(dimensions)['counts'].astype('int64')
+        )
+
+
+def _rollup(df, dimensions):
+
+    columns = dict(
+        (d, df.start_localtime.dt.normalize() if d == 'date'
+         else df[d].astype(object))
+        for d in dimensions
+    )
+
+    # dropna=False keeps instances with an empty program name or network
+    return pd.DataFrame(columns).groupby(
+        dimensions, sort=True, dropna=False
+    ).size().astype('int64')
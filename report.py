@@ -0,0 +1,289 @@
+'''
+report.py
+
+Build reports of transcript snippets for close reading, as DOCX, HTML or
+Markdown.
+
+Snippet extraction and rendering of each show's section run in a pool of
+worker processes; the main process only appends the pre-rendered sections in
+air date order. HTML and Markdown reports are streamed to disk section by
+section, so the whole report is never held in memory. Reports can be
+sharded into one file per network, per month, or per network and month.
+'''
+import html
+import os
+import re
+
+from collections import namedtuple
+from functools import partial
+
+from metacorps.app.models import parse_iatv_id
+from snippets import extract_snippets
+from transcript_store import TranscriptStore, read_transcript_file
+
+
+IATV_DETAILS_URL = 'https://archive.org/details/'
+
+FORMATS = {
+    '.docx': 'docx',
+    '.html': 'html',
+    '.htm': 'html',
+    '.md': 'markdown',
+}
+
+SHARD_KEYS = {
+    None: lambda f: None,
+    'network': lambda f: f.network,
+    'month': lambda f: f.start_localtime.strftime('%Y-%m'),
+    'network_month': lambda f: '{}_{}'.format(
+        f.network, f.start_localtime.strftime('%Y-%m')
+    ),
+}
+
+
+# One show's section of a report. content is a rendered string for html and
+# markdown, and a list of paragraphs of (text, bold) runs for docx.
+ShowFragment = namedtuple('ShowFragment', [
+    'iatv_id', 'network', 'program_name', 'start_localtime', 'heading',
+    'url', 'content'
+])
+
+
+def build_report(transcripts, output_path, vocabulary=('strangl',),
+                 title='EPA Metvi snippets', output_format=None,
+                 shard_by=None, processes=None, **extractor_kwargs):
+    '''
+    Write a report of every vocabulary match in transcripts.
+
+    Arguments:
+        transcripts: TranscriptStore, list of transcript file paths named
+            <iatv_id>.txt, or iterable of (iatv_id, text) pairs
+        output_path (str): report path; with sharding, the shard key is
+            appended to the file name
+        vocabulary (iterable): words or word stems to find
+        title (str): report title
+        output_format (str): 'docx', 'html' or 'markdown'; inferred from the
+            extension of output_path if None
+        shard_by (str): None, 'network', 'month' or 'network_month'
+        processes (int): worker processes; 1 renders in this process
+        extractor_kwargs: passed on to snippets.SnippetExtractor
+
+    Returns:
+        (list) paths of the written reports
+    '''
+    if output_format is None:
+        output_format = FORMATS.get(os.path.splitext(output_path)[1].lower())
+    if output_format not in FORMATS.values():
+        raise ValueError('output_format must be one of {}'.format(
+            sorted(set(FORMATS.values()))
+        ))
+    if shard_by not in SHARD_KEYS:
+        raise ValueError('shard_by must be one of {}'.format(
+            [k for k in SHARD_KEYS if k]
+        ))
+
+    writer_cls = DocxWriter if output_format == 'docx' else StreamingWriter
+    writers = {}
+    shard_key = SHARD_KEYS[shard_by]
+
+    try:
+        for fragment in render_fragments(
+                    transcripts, vocabulary, output_format,
+                    processes=processes, **extractor_kwargs
+                ):
+            key = shard_key(fragment)
+            if key not in writers:
+                writers[key] = writer_cls(
+                    _shard_path(output_path, key), title, output_format
+                )
+            writers[key].add(fragment)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return [writer.path for writer in writers.values()]
+
+
+def render_fragments(transcripts, vocabulary, output_format,
+                     processes=None, chunksize=8, **extractor_kwargs):
+    '''
+    Rendered ShowFragments of every transcript with at least one match, in
+    air date order. Sections are rendered by the snippet extraction workers;
+    see snippets.extract_snippets.
+    '''
+    for fragment in extract_snippets(
+                _ordered_transcripts(transcripts), vocabulary,
+                processes=processes, chunksize=chunksize,
+                transform=partial(_render_snippets, output_format),
+                **extractor_kwargs
+            ):
+        if fragment is not None:
+            yield fragment
+
+
+def _ordered_transcripts(transcripts):
+    '''
+    Lazily read (iatv_id, text) pairs sorted by air date.
+    '''
+    def air_date(iatv_id):
+        return parse_iatv_id(iatv_id)[2]
+
+    if isinstance(transcripts, TranscriptStore):
+        return ((iatv_id, transcripts.get(iatv_id))
+                for iatv_id in sorted(transcripts, key=air_date))
+
+    transcripts = list(transcripts)
+    if transcripts and isinstance(transcripts[0], str):
+        paths = dict(
+            (os.path.basename(path)[:-len('.txt')], path)
+            for path in transcripts
+        )
+        return ((iatv_id, read_transcript_file(paths[iatv_id]))
+                for iatv_id in sorted(paths, key=air_date))
+
+    return iter(sorted(transcripts, key=lambda item: air_date(item[0])))
+
+
+def _render_snippets(output_format, iatv_id, snippets):
+
+    if not snippets:
+        return None
+
+    network, program_name, start_localtime = parse_iatv_id(iatv_id)
+    heading = '{} - {} - {}/{}/{}'.format(
+        network, program_name, start_localtime.strftime('%m'),
+        start_localtime.strftime('%d'), start_localtime.year
+    )
+    url = IATV_DETAILS_URL + iatv_id
+
+    # as in the original snippets, only the focus keeps its case
+    paragraphs = [
+        [(text if bold else text.lower(), bold) for text, bold in s.parts()]
+        for s in snippets
+    ]
+
+    if output_format == 'html':
+        content = _render_html(heading, url, paragraphs)
+    elif output_format == 'markdown':
+        content = _render_markdown(heading, url, paragraphs)
+    else:
+        content = paragraphs
+
+    return ShowFragment(iatv_id, network, program_name, start_localtime,
+                        heading, url, content)
+
+
+def _render_html(heading, url, paragraphs):
+
+    lines = [
+        '<h2>{}</h2>'.format(html.escape(heading)),
+        '<p><a href="{0}">{0}</a></p>'.format(html.escape(url)),
+    ]
+    for runs in paragraphs:
+        lines.append('<p>{}</p>'.format(''.join(
+            '<b>{}</b>'.format(html.escape(text)) if bold
+            else html.escape(text)
+            for text, bold in runs
+        )))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _render_markdown(heading, url, paragraphs):
+
+    def escape(text):
+        return text.replace('*', '\\*').replace('_', '\\_').replace(
+            '<', '&lt;'
+        )
+
+    def bold_paragraph(text):
+        # emphasis markers must hug the text, so keep whitespace outside
+        stripped = text.strip()
+        if not stripped:
+            return text
+        lead = text[:len(text) - len(text.lstrip())]
+        trail = text[len(text.rstrip()):]
+        return '{}**{}**{}'.format(lead, escape(stripped), trail)
+
+    def bold(text):
+        # emphasis cannot span a paragraph break, so bold each paragraph
+        # of the focus on its own and keep the blank lines between them
+        pieces = re.split(r'(\n\s*\n)', text)
+        return ''.join(
+            piece if idx % 2 else bold_paragraph(piece)
+            for idx, piece in enumerate(pieces)
+        )
+
+    lines = ['## ' + escape(heading), '', '<{}>'.format(url), '']
+    for runs in paragraphs:
+        lines.append(''.join(
+            bold(text) if is_focus else escape(text)
+            for text, is_focus in runs
+        ))
+        lines.append('')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _shard_path(output_path, key):
+
+    if key is None:
+        return output_path
+
+    base, ext = os.path.splitext(output_path)
+
+    return '{}_{}{}'.format(base, key, ext)
+
+
+class StreamingWriter:
+    '''
+    Appends pre-rendered HTML or Markdown sections straight to disk.
+    '''
+
+    def __init__(self, path, title, output_format):
+        self.path = path
+        self.output_format = output_format
+        self.f = open(path, 'w')
+
+        if output_format == 'html':
+            self.f.write(
+                '<!DOCTYPE html>\n<html lang="en">\n<head>\n'
+                '<meta charset="UTF-8">\n<title>{0}</title>\n</head>\n'
+                '<body>\n<h1>{0}</h1>\n'.format(html.escape(title))
+            )
+        else:
+            self.f.write('# {}\n\n'.format(title))
+
+    def add(self, fragment):
+        self.f.write(fragment.content)
+
+    def close(self):
+        if self.output_format == 'html':
+            self.f.write('</body>\n</html>\n')
+        self.f.close()
+
+
+class DocxWriter:
+    '''
+    Appends pre-rendered sections to a python-docx Document, saved on close.
+    '''
+
+    def __init__(self, path, title, output_format='docx'):
+        from docx import Document
+
+        self.path = path
+        self.docx = Document()
+        self.docx.add_heading(title, 0)
+
+    def add(self, fragment):
+
+        self.docx.add_heading(fragment.heading)
+        self.docx.add_paragraph(fragment.url)
+
+        for runs in fragment.content:
+            p = self.docx.add_paragraph()
+            for text, bold in runs:
+                p.add_run(text).bold = bold
+
+    def close(self):
+        self.docx.save(self.path)
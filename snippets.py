@@ -0,0 +1,282 @@
+'''
+snippets.py
+
+Extract every occurrence of a facet vocabulary from transcripts, with
+surrounding context, in a single pass per transcript.
+
+The vocabulary is compiled into one case-insensitive regular expression
+matching any of the words as a word prefix (so 'strangl' matches
+'strangle', 'strangling', ...). Matches whose context windows overlap are
+merged into one snippet. Many transcripts can be scanned in a process pool.
+
+Run as `python snippets.py [n_transcripts]` to benchmark against scanning
+once per word.
+'''
+import re
+import sys
+import time
+
+from collections import namedtuple
+from multiprocessing import Pool
+
+
+# characters around a match shown in bold, and the context shown around that
+DEFAULT_FOCUS_CHARS = 65
+DEFAULT_CONTEXT_CHARS = 1000
+
+
+class Snippet(namedtuple('Snippet', [
+            'iatv_id', 'words', 'start', 'end', 'focus_spans', 'text'
+        ])):
+    '''
+    Context window around one or more vocabulary matches in a transcript.
+
+    Attributes:
+        iatv_id (str): transcript the snippet was taken from
+        words (list): vocabulary words matched, in order of appearance
+        start, end (int): window offsets into the transcript
+        focus_spans (list): merged (start, end) transcript offsets of the
+            text around each match
+        text (str): transcript text of the window
+    '''
+    __slots__ = ()
+
+    def parts(self):
+        '''
+        (text, is_focus) pieces of the snippet in order, for rendering.
+        '''
+        parts = []
+        pos = self.start
+        for fstart, fend in self.focus_spans:
+            if fstart > pos:
+                parts.append((self.text[pos - self.start:fstart - self.start],
+                              False))
+            parts.append((self.text[fstart - self.start:fend - self.start],
+                          True))
+            pos = fend
+        if pos < self.end:
+            parts.append((self.text[pos - self.start:], False))
+
+        return parts
+
+    def pre_focus_post(self):
+        '''
+        The snippet as (pre, focus, post), with focus running from the first
+        to the last focus span.
+        '''
+        fstart = self.focus_spans[0][0] - self.start
+        fend = self.focus_spans[-1][1] - self.start
+
+        return self.text[:fstart], self.text[fstart:fend], self.text[fend:]
+
+
+class SnippetExtractor:
+
+    def __init__(self, vocabulary, focus_chars=DEFAULT_FOCUS_CHARS,
+                 context_chars=DEFAULT_CONTEXT_CHARS, whole_words=False):
+        '''
+        Arguments:
+            vocabulary (iterable): words or word stems to find, e.g.
+                analysis.DEFAULT_FACET_WORDS or a project's facet words
+            focus_chars (int): characters either side of a match in focus
+            context_chars (int): characters either side of a match in the
+                snippet window
+            whole_words (bool): match only whole words instead of prefixes
+        '''
+        self.vocabulary = sorted(set(w.strip() for w in vocabulary if w),
+                                 key=len, reverse=True)
+        if not self.vocabulary:
+            raise ValueError('vocabulary must contain at least one word')
+
+        self.focus_chars = focus_chars
+        self.context_chars = max(context_chars, focus_chars)
+        self.whole_words = whole_words
+
+        self._words = dict((w.lower(), w) for w in self.vocabulary)
+        self.pattern = re.compile(
+            r'\b(' + '|'.join(re.escape(w) for w in self.vocabulary) + ')' +
+            (r'\b' if whole_words else r'\w*'),
+            re.IGNORECASE
+        )
+
+    def __call__(self, iatv_id, transcript):
+        return self.extract(iatv_id, transcript)
+
+    def extract(self, iatv_id, transcript):
+        '''
+        Every match in one transcript, as Snippets with overlapping windows
+        merged. Returns an empty list if nothing matches.
+        '''
+        n_chars = len(transcript)
+        snippets = []
+
+        words = []
+        window = None
+        focus_spans = []
+        for m in self.pattern.finditer(transcript):
+            start = max(m.start() - self.context_chars, 0)
+            end = min(m.end() + self.context_chars, n_chars)
+            focus = (max(m.start() - self.focus_chars, 0),
+                     min(m.end() + self.focus_chars, n_chars))
+
+            if window is not None and start <= window[1]:
+                window = (window[0], end)
+                if focus[0] <= focus_spans[-1][1]:
+                    focus_spans[-1] = (focus_spans[-1][0], focus[1])
+                else:
+                    focus_spans.append(focus)
+            else:
+                if window is not None:
+                    snippets.append(self._snippet(
+                        iatv_id, transcript, words, window, focus_spans
+                    ))
+                window = (start, end)
+                words = []
+                focus_spans = [focus]
+
+            words.append(self._words[m.group(1).lower()])
+
+        if window is not None:
+            snippets.append(self._snippet(
+                iatv_id, transcript, words, window, focus_spans
+            ))
+
+        return snippets
+
+    def _snippet(self, iatv_id, transcript, words, window, focus_spans):
+        return Snippet(iatv_id, words, window[0], window[1], focus_spans,
+                       transcript[window[0]:window[1]])
+
+
+# extractor and transform of each worker process, set by _init_worker
+_worker_extractor = None
+_worker_transform = None
+
+
+def _init_worker(extractor_kwargs, transform):
+    global _worker_extractor, _worker_transform
+    _worker_extractor = SnippetExtractor(**extractor_kwargs)
+    _worker_transform = transform
+
+
+def _extract_item(item):
+
+    snippets = _worker_extractor.extract(*item)
+    if _worker_transform is None:
+        return snippets
+
+    return _worker_transform(item[0], snippets)
+
+
+def extract_snippets(transcripts, vocabulary, processes=None,
+                     chunksize=16, transform=None, **extractor_kwargs):
+    '''
+    Extract snippets from many transcripts.
+
+    Arguments:
+        transcripts (iterable): (iatv_id, transcript text) pairs, e.g.
+            TranscriptStore.items()
+        vocabulary (iterable): words to find
+        processes (int): size of the worker pool; 1 scans in this process,
+            None uses one worker per CPU
+        chunksize (int): transcripts sent to a worker at a time
+        transform (callable): called in the worker as
+            transform(iatv_id, snippets) for each transcript, and its
+            result yielded instead of the snippets; must be picklable, e.g.
+            a module-level function or a functools.partial of one
+        extractor_kwargs: passed on to SnippetExtractor
+
+    Yields:
+        (list) Snippets of each transcript, or what transform returns for
+            them, in input order
+    '''
+    extractor_kwargs['vocabulary'] = list(vocabulary)
+
+    if processes == 1:
+        _init_worker(extractor_kwargs, transform)
+        for item in transcripts:
+            yield _extract_item(item)
+        return
+
+    with Pool(processes, initializer=_init_worker,
+              initargs=(extractor_kwargs, transform)) as pool:
+        for result in pool.imap(_extract_item, transcripts, chunksize):
+            yield result
+
+
+def _per_word_snippets(vocabulary, transcripts,
+                       focus_chars=DEFAULT_FOCUS_CHARS,
+                       context_chars=DEFAULT_CONTEXT_CHARS):
+    '''
+    Baseline for the benchmark, as snippets were cut before: one regex scan
+    of every transcript per word, cutting (pre, focus, post) around each
+    match, with the context lowercased.
+    '''
+    snippets = []
+    for iatv_id, transcript in transcripts:
+        for word in vocabulary:
+            for m in re.finditer(r'\b' + re.escape(word) + r'\w*',
+                                 transcript, re.IGNORECASE):
+                fstart = max(m.start() - focus_chars, 0)
+                fend = m.end() + focus_chars
+                pre = transcript[
+                    max(m.start() - context_chars, 0):fstart
+                ].lower()
+                focus = transcript[fstart:fend]
+                post = transcript[fend:m.end() + context_chars].lower()
+                snippets.append((iatv_id, word, pre, focus, post))
+
+    return snippets
+
+
+def benchmark(n_transcripts=2000, transcript_chars=50000):
+    '''
+    Compare per-word scans with the combined single-pass extractor on
+    synthetic transcripts.
+    '''
+    import random
+
+    from metacorps.projects.common.analysis import DEFAULT_FACET_WORDS
+
+    rng = random.Random(42)
+    filler = ('the economy regulation epa said today on the show that '
+              'we will see what happens next week ').split()
+    words = filler + [w.upper() + 'ING' for w in DEFAULT_FACET_WORDS]
+
+    transcripts = []
+    for idx in range(n_transcripts):
+        text = []
+        n_chars = 0
+        while n_chars < transcript_chars:
+            word = rng.choice(filler) if rng.random() < 0.995 \
+                else rng.choice(words)
+            text.append(word)
+            n_chars += len(word) + 1
+        transcripts.append(('SHOW_{}'.format(idx), ' '.join(text)))
+
+    t0 = time.perf_counter()
+    n_per_word = len(_per_word_snippets(DEFAULT_FACET_WORDS, transcripts))
+    t_per_word = time.perf_counter() - t0
+
+    results = {}
+    for processes in (1, None):
+        t0 = time.perf_counter()
+        snippets = list(extract_snippets(transcripts, DEFAULT_FACET_WORDS,
+                                         processes=processes))
+        results[processes] = time.perf_counter() - t0
+    n_matches = sum(len(s.words) for shows in snippets for s in shows)
+
+    print('snippet extraction, {} transcripts of {} chars, {} words'.format(
+        n_transcripts, transcript_chars, len(DEFAULT_FACET_WORDS)
+    ))
+    print('    per-word scans:     {:.2f}s, {} matches'.format(
+        t_per_word, n_per_word
+    ))
+    print('    combined, 1 proc:   {:.2f}s'.format(results[1]))
+    print('    combined, pool:     {:.2f}s, {} matches'.format(
+        results[None], n_matches
+    ))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from metacorps.projects.common.analysis import (
+    daily_entity_counts, normalize_data_frame
+)
+from metacorps.projects.common.rollup import RollupCube
+
+
+def test_normalize_all_missing_column():
+    df = pd.DataFrame({
+        'tense': [np.nan, np.nan],
+        'conceptual_metaphor': [' Attack', 'attack'],
+    })
+
+    normalized = normalize_data_frame(df)
+
+    assert normalized.tense.isna().all()
+    assert list(normalized.conceptual_metaphor) == ['attack', 'attack']
+
+
+def test_daily_entity_counts_all_missing_subjects():
+    df = pd.DataFrame({
+        'start_localtime': pd.to_datetime(['2016-09-01', '2016-09-02']),
+        'network': ['CNNW', 'MSNBCW'],
+        'subjects': [np.nan, np.nan],
+    })
+
+    assert daily_entity_counts(df).empty
+
+
+def test_daily_entity_counts_from_cube():
+    df = pd.DataFrame({
+        'start_localtime': pd.to_datetime([
+            '2016-09-01 10:00', '2016-09-01 18:00', '2016-09-02 09:00',
+            '2016-09-02 11:00'
+        ]),
+        'network': ['CNNW', 'CNNW', 'MSNBCW', 'MSNBCW'],
+        'subjects': ['Donald Trump', 'donald trump ', 'hillary clinton',
+                     'trump/clinton'],
+    })
+    cube = RollupCube.from_frame(df, ['date', 'network', 'subjects'])
+
+    pd.testing.assert_frame_equal(
+        daily_entity_counts(cube), daily_entity_counts(df)
+    )
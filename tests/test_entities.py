@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+from metacorps.projects.common.entities import EntityAliases
+
+
+def test_canonical_follows_alias_order():
+    aliases = EntityAliases()
+
+    assert aliases.canonical('hillary clinton and donald trump') == \
+        'donald trump'
+    assert aliases.canonical('donald trump/hillary clinton') is None
+
+
+def test_canonicalize_all_missing():
+    aliases = EntityAliases()
+
+    for column in (pd.Series([np.nan, np.nan]),
+                   pd.Series(pd.Categorical([None, None]))):
+        assert aliases.canonicalize(column).isna().all()
@@ -0,0 +1,219 @@
+'''
+transcript_store.py
+
+Compressed, indexed local store of show transcripts.
+
+All transcripts live in one append-only data file of independently
+compressed blocks, one per transcript. A JSON-lines index next to it maps
+each iatv_id to the offset and length of its block plus metadata (network,
+air date, program name) parsed once from the id. Reading one transcript is a
+single positioned read and the decompression of one block. Blocks are zstd
+compressed if the zstandard package is installed and zlib compressed
+otherwise; the codec is recorded per block.
+'''
+import ast
+import json
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from metacorps.app.models import parse_iatv_id
+
+
+DATA_NAME = 'transcripts.blocks'
+INDEX_NAME = 'transcripts.index.jsonl'
+
+
+class TranscriptStore:
+
+    def __init__(self, store_dir, codec=None):
+        '''
+        Open, or create, the transcript store in store_dir.
+
+        Arguments:
+            store_dir (str): directory holding the data and index files
+            codec (str): 'zstd' or 'zlib' for new blocks; defaults to zstd
+                when available
+        '''
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'zlib'
+        if codec == 'zstd' and zstandard is None:
+            raise RuntimeError('zstandard is required for the zstd codec')
+        if codec not in ('zstd', 'zlib'):
+            raise ValueError("codec must be 'zstd' or 'zlib'")
+
+        self.store_dir = store_dir
+        self.codec = codec
+
+        os.makedirs(store_dir, exist_ok=True)
+        self.data_path = os.path.join(store_dir, DATA_NAME)
+        self.index_path = os.path.join(store_dir, INDEX_NAME)
+
+        self._lock = threading.Lock()
+        self.index = self._read_index()
+
+        # touch so the read handle can always be opened
+        open(self.data_path, 'ab').close()
+        self._read_fd = os.open(self.data_path, os.O_RDONLY)
+
+    def _read_index(self):
+
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    # a crash can leave a partial last line; skip it
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    # later entries replace earlier ones for the same id
+                    index[entry['iatv_id']] = entry
+
+        return index
+
+    def __contains__(self, iatv_id):
+        return iatv_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def metadata(self, iatv_id):
+        '''
+        Index entry of a transcript: network, date (YYYY-MM-DD),
+        program_name and the location of its block.
+        '''
+        return self.index[iatv_id]
+
+    def get(self, iatv_id):
+        '''
+        Transcript text of iatv_id; raises KeyError if it is not stored.
+        '''
+        entry = self.index[iatv_id]
+        block = os.pread(self._read_fd, entry['length'], entry['offset'])
+
+        return _decompress(block, entry['codec']).decode('utf-8')
+
+    def items(self, iatv_ids=None):
+        '''
+        (iatv_id, text) pairs in data file order, so reading the whole
+        store is one sequential pass.
+        '''
+        if iatv_ids is None:
+            iatv_ids = self.index
+        ids = sorted(iatv_ids, key=lambda i: self.index[i]['offset'])
+
+        for iatv_id in ids:
+            yield iatv_id, self.get(iatv_id)
+
+    def put(self, iatv_id, text):
+        '''
+        Append a transcript. The block is written and flushed before its
+        index entry, so the index never points at missing data. Storing an
+        id again supersedes the earlier copy. Safe to call from threads.
+        '''
+        block = _compress(text.encode('utf-8'), self.codec)
+
+        entry = dict(iatv_id=iatv_id, codec=self.codec, length=len(block))
+        entry.update(_id_metadata(iatv_id))
+
+        with self._lock:
+            with open(self.data_path, 'ab') as f:
+                entry['offset'] = f.seek(0, os.SEEK_END)
+                f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+            self.index[iatv_id] = entry
+
+    def close(self):
+        os.close(self._read_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def import_transcript_dir(transcript_dir, store):
+    '''
+    Add the loose <iatv_id>.txt transcripts written by earlier versions of
+    util.download_instance_transcripts to store. Those files hold the repr
+    of the utf-8 encoded transcript, which is decoded back to plain text.
+
+    Returns:
+        (int) number of transcripts imported
+    '''
+    n_imported = 0
+    for fname in sorted(os.listdir(transcript_dir)):
+        if not fname.endswith('.txt'):
+            continue
+
+        iatv_id = fname[:-len('.txt')]
+        if iatv_id in store:
+            continue
+
+        store.put(iatv_id, read_transcript_file(
+            os.path.join(transcript_dir, fname)
+        ))
+        n_imported += 1
+
+    return n_imported
+
+
+def read_transcript_file(path):
+    '''
+    Text of a loose transcript file, decoding the bytes repr written by
+    earlier versions of util.download_instance_transcripts if present.
+    '''
+    with open(path) as f:
+        text = f.read()
+
+    if text.startswith(("b'", 'b"')):
+        text = ast.literal_eval(text).decode('utf-8')
+
+    return text
+
+
+def _id_metadata(iatv_id):
+
+    try:
+        network, program_name, start_localtime = parse_iatv_id(iatv_id)
+    except (IndexError, ValueError):
+        return dict(network=None, date=None, program_name=None)
+
+    return dict(
+        network=network,
+        date=start_localtime.strftime('%Y-%m-%d'),
+        program_name=program_name
+    )
+
+
+def _compress(data, codec):
+
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+
+    return zlib.compress(data, 6)
+
+
+def _decompress(block, codec):
+
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd blocks')
+        return zstandard.ZstdDecompressor().decompress(block)
+
+    return zlib.decompress(block)
@@ -1,93 +1,208 @@
+import json
 import os
-import re
+import tempfile
+import time
 
-from docx import Document
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from metacorps.projects.common.export_project import ProjectExporter
 from iatv.iatv import Show
+from report import build_report
+from snippets import SnippetExtractor
+from transcript_store import TranscriptStore
 
 
-def download_instance_transcripts(debug_lim=3,
-                                  write_dir='transcripts'):
+MANIFEST_NAME = 'manifest.json'
+
 
-    df = ProjectExporter('EPA Metvi').export_dataframe()
+def download_instance_transcripts(debug_lim=3,
+                                  write_dir='transcripts',
+                                  project_name='EPA Metvi',
+                                  **fetch_kwargs):
+    '''
+    Download transcripts of every show with an instance in the project to
+    write_dir. See fetch_transcripts for the remaining keyword arguments.
+    '''
+    df = ProjectExporter(project_name).export_dataframe()
 
     inst_ids = df.iatv_id.unique()
     if debug_lim > 0:
         inst_ids = inst_ids[:debug_lim]
 
-    N_inst = len(inst_ids)
-
-    for idx, inst_id in enumerate(inst_ids):
-
+    return fetch_transcripts(inst_ids, write_dir, **fetch_kwargs)
+
+
+def _get_show_transcript(iatv_id):
+    return Show(iatv_id).get_transcript(verbose=False)
+
+
+def fetch_transcripts(iatv_ids, write_dir='transcripts', max_workers=8,
+                      retries=3, backoff=1.0, get_transcript=None,
+                      progress_every=50):
+    '''
+    Fetch transcripts concurrently into the TranscriptStore in write_dir.
+
+    A manifest of completed, failed and pending ids is kept in write_dir,
+    and a re-run only fetches transcripts that are not already in the store.
+
+    Arguments:
+        iatv_ids (iterable): ids of the shows to fetch
+        write_dir (str): directory for transcripts and the manifest
+        max_workers (int): number of concurrent fetches
+        retries (int): attempts per transcript before recording a failure
+        backoff (float): seconds to wait after the first failed attempt,
+            doubled after each further failure
+        get_transcript (callable): iatv_id -> list of transcript lines;
+            defaults to fetching from archive.org with iatv.Show, and can be
+            replaced by a local stub for testing
+        progress_every (int): print progress after this many transcripts
+
+    Returns:
+        (dict) manifest with 'completed', 'failed' and 'pending' entries
+    '''
+    if get_transcript is None:
+        get_transcript = _get_show_transcript
+
+    store = TranscriptStore(write_dir)
+    manifest_path = os.path.join(write_dir, MANIFEST_NAME)
+
+    completed = set(store)
+    failed = {}
+    pending = [inst_id for inst_id in dict.fromkeys(iatv_ids)
+               if inst_id not in completed]
+
+    N_inst = len(pending)
+    print('{} transcripts already downloaded, fetching {}'.format(
+        len(completed), N_inst
+    ))
+
+    t0 = time.time()
+    n_done = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict(
+            (executor.submit(_fetch_transcript, inst_id, store,
+                             get_transcript, retries, backoff), inst_id)
+            for inst_id in pending
+        )
+        for future in as_completed(futures):
+            inst_id = futures[future]
+            n_done += 1
+            try:
+                future.result()
+                completed.add(inst_id)
+            except Exception as e:
+                failed[inst_id] = repr(e)
+                print('failed to save {} ({}/{}): {!r}'.format(
+                    inst_id, n_done, N_inst, e
+                ))
+
+            if n_done % progress_every == 0 or n_done == N_inst:
+                elapsed = time.time() - t0
+                print('fetched {}/{} ({} failed), {:.1f} transcripts/s'.format(
+                    n_done, N_inst, len(failed),
+                    n_done / elapsed if elapsed else 0.0
+                ))
+                _write_manifest(manifest_path, completed, failed, pending)
+
+    store.close()
+
+    return _write_manifest(manifest_path, completed, failed, pending)
+
+
+def _fetch_transcript(inst_id, store, get_transcript, retries, backoff):
+
+    for attempt in range(retries):
         try:
-            show = Show(inst_id)
-            trans = show.get_transcript(verbose=False)
-
-            fulltext = str(u'\n\n'.join(trans).encode('utf-8'))
-
-            write_path = os.path.join(write_dir, inst_id + '.txt')
-            open(write_path, 'w').write(fulltext)
-
-            print('saved {} to {} ({}/{})'.format(inst_id, write_path, idx+1, N_inst))
-
-        except:
-            print('failed to save {} to {} ({}/{})'.format(inst_id, write_path, idx+1, N_inst))
-
-
-def format_snippet(transcript, re_word=r'STRANGL'):
-
-    f_iter = re.finditer(re_word, transcript)
-    tr = transcript
+            trans = get_transcript(inst_id)
+            break
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+    store.put(inst_id, u'\n\n'.join(trans))
+
+
+def _atomic_write(path, text):
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _write_manifest(manifest_path, completed, failed, pending):
+
+    manifest = {
+        'completed': sorted(completed),
+        'failed': failed,
+        'pending': [inst_id for inst_id in pending
+                    if inst_id not in completed and inst_id not in failed],
+    }
+    _atomic_write(manifest_path, json.dumps(manifest, indent=1))
+
+    return manifest
+
+
+def format_snippet(transcript, re_word=r'STRANGL', vocabulary=None,
+                   iatv_id=None, **extractor_kwargs):
+    '''
+    Every match of the vocabulary in transcript as (pre, focus, post) text
+    triples, with pre and post lowercased. Matches with overlapping context
+    are merged into one triple. Returns an empty list if nothing matches.
+
+    Arguments:
+        transcript (str): transcript text
+        re_word (str): single word stem to find if vocabulary is None
+        vocabulary (list): words or word stems to find
+        iatv_id (str): id of the transcript, if known
+        extractor_kwargs: passed on to snippets.SnippetExtractor
+    '''
+    if vocabulary is None:
+        vocabulary = [re_word]
+
+    extractor = SnippetExtractor(vocabulary, **extractor_kwargs)
 
     def cleanup(s):
         return s.replace("\\'", "'").replace('\\n\\n', '\n\n')
 
     formatted = []
-    for idx, m in enumerate(f_iter):
-        # pre = '# {}\n\n'.format(idx + 1) + cleanup(tr[m.start() - 1000: m.start() - 65]).lower()
-        pre = cleanup(tr[m.start() - 1000: m.start() - 65]).lower()
-        focus = cleanup(tr[m.start() - 65: m.end() + 65])
-        post = cleanup(tr[m.end() + 65: m.end() + 1000]).lower()
-        # formatted.append(pre + focus + post)
+    for snippet in extractor.extract(iatv_id, transcript):
+        pre, focus, post = snippet.pre_focus_post()
+        formatted.append(
+            (cleanup(pre).lower(), cleanup(focus), cleanup(post).lower())
+        )
 
-    # return formatted
-    return (pre, focus, post)
+    return formatted
 
 
 def make_docx(transcript_paths,
               title='EPA Metvi snippets',
-              docx_path='transcripts.docx'):
-
-    docx = Document()
-    docx.add_heading(title, 0)
-
-    transcript_paths.sort(key=lambda x: int(x.split('_')[1]))
-
-    for trp in transcript_paths:
-
-        tr = open(trp, 'r').read()
-        pre, focus, post = format_snippet(tr)
-
-        split_path = trp.split('_')
-        channel = split_path[0].split('/')[-1]
-        year = split_path[1][:4]
-        month = split_path[1][4:6]
-        day = split_path[1][6:]
-
-        show = ' '.join(split_path[3:]).replace('.txt', '')
-
-        docx.add_heading('{} - {} - {}/{}/{}'.format(
-            channel, show, month, day, year
-        ))
-
-        docx.add_paragraph(
-            'https://archive.org/details/' +
-            trp.split('/')[-1].replace('.txt', '')
-        )
-
-        p = docx.add_paragraph(pre)
-        p.add_run(focus).bold = True
-        p.add_run(post)
-
-    docx.save(docx_path)
+              docx_path='transcripts.docx',
+              vocabulary=('strangl',),
+              shard_by=None,
+              processes=None):
+    '''
+    Write a DOCX of every vocabulary match in the transcripts, one section
+    per show in air date order. See report.build_report, which also writes
+    HTML and Markdown reports.
+
+    Arguments:
+        transcript_paths (list or TranscriptStore): paths of <iatv_id>.txt
+            transcripts, or a TranscriptStore
+        title (str): document title
+        docx_path (str): output path
+        vocabulary (iterable): words or word stems to find
+        shard_by (str): None, 'network', 'month' or 'network_month' to
+            write one document per shard
+        processes (int): worker processes for snippet extraction
+    '''
+    return build_report(transcript_paths, docx_path, vocabulary=vocabulary,
+                        title=title, output_format='docx', shard_by=shard_by,
+                        processes=processes)